@@ -0,0 +1,378 @@
+""" Load test of the /get/ route: thousands of virtual devices request the
+image of their display like the firmware, against a local server of which
+the widgets load fixtures instead of fetching their data.
+
+Run from the epaper-server directory:
+
+    python -m benchmarks.load run --devices 2000 --displays 50 --duration 60
+
+Without --config, the displays only show the date. A display of a config can
+be used with the fixtures recorded by `python run.py bench --record`.
+"""
+import sys
+import copy
+import json
+import time
+import random
+import signal
+import asyncio
+import resource
+import tempfile
+import subprocess
+import click
+import aiohttp
+import run as server
+from epaperengine.bench import load_fixtures, percentile
+from epaperengine.display import Display
+
+# Display rendered when no config is given, it has no data to fetch
+DEFAULT_DISPLAY = {
+    "size": "640x384",
+    "updateEvery": 600,
+    "settings": {"locale": "en_US", "timezone": "UTC"},
+    "widgets": [{"widget": "date", "position": "0, 0", "size": "640x68"}],
+}
+
+# Seconds to wait after a failed request, SETTINGS_DEFAULT_UPDATE_TIME of the
+# firmware
+DEFAULT_UPDATE_TIME = 60
+
+# Seconds to wait for the first image of all the displays
+STARTUP_TIMEOUT = 120
+
+LAG_METRIC = "epaper_event_loop_lag_seconds"
+
+
+def stub_updates(fixtures):
+    """ Replaces the updates of the widgets by the loading of the fixtures,
+    indexed by widget, so that the server never fetches data
+    """
+
+    async def update_widgets_async(self, http, indexes=None):
+        if indexes is None:
+            indexes = range(len(self.widgets))
+        for index in indexes:
+            if fixtures[index] is not None:
+                self.widgets[index][0].load_data(fixtures[index])
+            self.updated.add(index)
+
+        return []
+
+    Display.update_widgets_async = update_widgets_async
+
+
+def max_age(cache_control):
+    """ Returns the max-age of a Cache-Control header, or None like the
+    firmware if it is not the first directive
+    """
+    if not cache_control.startswith("max-age="):
+        return None
+    try:
+        return int(cache_control[len("max-age=") :].split(",")[0])
+    except ValueError:
+        return None
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.bytes = 0
+
+
+async def device(session, url, token, deadline, spread, time_scale, results):
+    """ Requests the image with the ETag of the current one, then waits for
+    the max-age of the response like the firmware
+    """
+    await asyncio.sleep(random.uniform(0, spread))
+
+    etag = ""
+    while time.monotonic() < deadline:
+        wait = DEFAULT_UPDATE_TIME
+        start = time.perf_counter()
+        try:
+            headers = {"X-Display-ID": token, "ETag": etag}
+            async with session.get(url, headers=headers) as response:
+                body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            results.errors += 1
+            etag = ""
+        else:
+            results.latencies.append(time.perf_counter() - start)
+            results.statuses[response.status] = (
+                results.statuses.get(response.status, 0) + 1
+            )
+            results.bytes += len(body)
+
+            if response.status in (200, 304):
+                etag = response.headers.get("ETag", etag)
+                wait = max_age(response.headers.get("Cache-Control", "")) or wait
+            else:
+                etag = ""
+
+        await asyncio.sleep(max(0, min(wait / time_scale, deadline - time.monotonic())))
+
+
+def parse_histogram(text, name):
+    """ Returns the cumulative counts by upper bound, the sum and the count
+    of a histogram in the Prometheus text format
+    """
+    buckets, total, count = {}, 0.0, 0
+    for line in text.splitlines():
+        sample, _, value = line.rpartition(" ")
+        if sample.startswith(f"{name}_bucket"):
+            bound = sample.split('le="')[1].split('"')[0]
+            buckets[float(bound)] = int(value)
+        elif sample == f"{name}_sum":
+            total = float(value)
+        elif sample == f"{name}_count":
+            count = int(value)
+
+    return buckets, total, count
+
+
+def lag_statistics(before, after):
+    """ Returns the mean and the upper bound of the 99th percentile of the
+    event loop lag observed between two scrapes of the metrics
+    """
+    buckets_before, total_before, count_before = parse_histogram(before, LAG_METRIC)
+    buckets_after, total_after, count_after = parse_histogram(after, LAG_METRIC)
+    count = count_after - count_before
+    if count == 0:
+        return None
+
+    p99 = next(
+        bound
+        for bound, observed in sorted(buckets_after.items())
+        if observed - buckets_before.get(bound, 0) >= 0.99 * count
+    )
+    return {"mean": (total_after - total_before) / count, "p99": p99}
+
+
+async def wait_ready(session, url, tokens, process):
+    """ Waits until the server serves an image for each display
+    """
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    pending = set(tokens)
+    while pending:
+        if process.poll() is not None:
+            raise click.ClickException("The server exited, see --server-log")
+        if time.monotonic() > deadline:
+            raise click.ClickException("The displays were not rendered in time")
+
+        for token in list(pending):
+            try:
+                headers = {"X-Display-ID": token}
+                async with session.get(f"{url}get/", headers=headers) as response:
+                    if response.status == 200:
+                        pending.discard(token)
+            except aiohttp.ClientError:
+                # Not listening yet
+                break
+
+        await asyncio.sleep(0.5)
+
+
+async def run_devices(url, tokens, process, duration, spread, time_scale):
+    async with aiohttp.ClientSession() as session:
+        # A device of each display
+        displays = {id: token for token, id in tokens.items()}
+        await wait_ready(session, url, displays.values(), process)
+        async with session.get(f"{url}metrics") as response:
+            metrics_before = await response.text()
+
+        # The firmware opens a new connection for each request
+        results = Results()
+        connector = aiohttp.TCPConnector(limit=0, force_close=True)
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as devices:
+            start = time.monotonic()
+            await asyncio.gather(
+                *(
+                    device(
+                        devices,
+                        f"{url}get/",
+                        token,
+                        start + duration,
+                        spread,
+                        time_scale,
+                        results,
+                    )
+                    for token in tokens
+                )
+            )
+            elapsed = time.monotonic() - start
+
+        async with session.get(f"{url}metrics") as response:
+            metrics_after = await response.text()
+
+    requests = len(results.latencies) + results.errors
+    return {
+        "devices": len(tokens),
+        "displays": len(set(tokens.values())),
+        "duration": elapsed,
+        "requests": requests,
+        "throughput": requests / elapsed,
+        "latency": {
+            "p50": percentile(results.latencies, 0.5) if results.latencies else None,
+            "p99": percentile(results.latencies, 0.99) if results.latencies else None,
+        },
+        "statuses": {str(status): count for status, count in results.statuses.items()},
+        "errors": results.errors,
+        "bytes": results.bytes,
+        "event_loop_lag": lag_statistics(metrics_before, metrics_after),
+    }
+
+
+def format_results(results):
+    lines = [
+        f"Devices       : {results['devices']} on {results['displays']} displays",
+        f"Requests      : {results['requests']} in {results['duration']:.1f}s "
+        f"({results['throughput']:.1f}/s)",
+    ]
+    latency = results["latency"]
+    if latency["p50"] is not None:
+        lines.append(
+            f"Latency       : p50 {latency['p50'] * 1000:.1f}ms, "
+            f"p99 {latency['p99'] * 1000:.1f}ms"
+        )
+    statuses = ", ".join(
+        f"{status}: {count}" for status, count in sorted(results["statuses"].items())
+    )
+    lines.append(f"Statuses      : {statuses or 'none'}, errors: {results['errors']}")
+    lines.append(f"Bytes sent    : {results['bytes'] / 1024:.1f} KiB")
+
+    lag = results["event_loop_lag"]
+    if lag is not None:
+        lines.append(
+            f"Event loop lag: mean {lag['mean'] * 1000:.1f}ms, "
+            f"p99 <= {lag['p99'] * 1000:.0f}ms"
+        )
+
+    return "\n".join(lines)
+
+
+def raise_file_limit():
+    # Each device holds a connection while it waits for its response
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:
+        hard = 65536
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command(name="run")
+@click.option("--devices", default=1000, help="The number of virtual devices")
+@click.option("--displays", default=10, help="The number of displays they show")
+@click.option("--duration", default=60, help="The duration of the test in seconds")
+@click.option(
+    "--spread",
+    default=0.0,
+    help="Spread the first requests over this number of seconds (0: all at once)",
+)
+@click.option(
+    "--time-scale", default=1.0, help="Divide the waiting times by this factor"
+)
+@click.option("--config", help="The config of the display to copy")
+@click.option("--display", help="The display to copy, the first one by default")
+@click.option("--fixtures", help="The data of its widgets")
+@click.option("--port", default=8090, help="The port of the server")
+@click.option(
+    "--render-workers", default=0, help="The number of rendering processes (0: threads)"
+)
+@click.option(
+    "--server-log", default="/dev/null", help="Where to write the server logs"
+)
+@click.option("--json", "as_json", is_flag=True, help="Output the results as JSON")
+def load(
+    devices,
+    displays,
+    duration,
+    spread,
+    time_scale,
+    config,
+    display,
+    fixtures,
+    port,
+    render_workers,
+    server_log,
+    as_json,
+):
+    """ Starts a server with stubbed widgets and runs the virtual devices
+    """
+    template = DEFAULT_DISPLAY
+    if config is not None:
+        with open(config) as config_file:
+            configured = json.load(config_file)["displays"]
+        template = configured[display or next(iter(configured))]
+
+    ids = [f"load-{index}" for index in range(displays)]
+    tokens = {f"device-{index}": ids[index % displays] for index in range(devices)}
+    load_config = {
+        "displays": {id: copy.deepcopy(template) for id in ids},
+        "tokens": tokens,
+    }
+
+    raise_file_limit()
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as config_file:
+        json.dump(load_config, config_file)
+        config_file.flush()
+
+        command = [sys.executable, "-m", "benchmarks.load", "serve"]
+        command += ["--config", config_file.name, "--port", str(port)]
+        command += ["--render-workers", str(render_workers)]
+        if fixtures is not None:
+            command += ["--fixtures", fixtures]
+
+        with open(server_log, "w") as log:
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+            try:
+                results = asyncio.run(
+                    run_devices(
+                        f"http://127.0.0.1:{port}/",
+                        tokens,
+                        process,
+                        duration,
+                        spread,
+                        time_scale,
+                    )
+                )
+            finally:
+                # Shut down cleanly like after Ctrl+C
+                process.send_signal(signal.SIGINT)
+                process.wait()
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+    else:
+        click.echo(format_results(results))
+
+
+@cli.command()
+@click.option("--config", required=True, help="The path to the config")
+@click.option("--fixtures", help="The data of the widgets of every display")
+@click.option("--port", default=8090, help="The port to listen to")
+@click.option("--render-workers", default=0, help="The number of rendering processes")
+def serve(config, fixtures, port, render_workers):
+    """ Runs the server, the widgets load the fixtures instead of updating
+    """
+    with open(config) as config_file:
+        template = next(iter(json.load(config_file)["displays"].values()))
+
+    widgets = len(template["widgets"])
+    stub_updates(load_fixtures(fixtures) if fixtures else [None] * widgets)
+
+    args = ["--config", config, "--port", str(port)]
+    args += ["--render-workers", str(render_workers)]
+    server.run.main(args, standalone_mode=False)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,80 @@
+""" Compares the cost of DrawHelper.text with the previous per-pixel
+implementation.
+
+Run from the epaper-server directory: python -m benchmarks.text
+"""
+import timeit
+from PIL import Image, ImageDraw
+from epaperengine.helper import (
+    DrawHelper,
+    FontProvider,
+    ImageProvider,
+    TextProvider,
+    palette_image,
+)
+
+FONT = ("OpenSans-Bold-webfont.woff", 28)
+TEXTS = ["12:30", "21°C", "Saturday, October 17, 2026", "1 hour 5 minutes"]
+ITERATIONS = 200
+
+
+def legacy_text(helper, position, text, font, fill):
+    font_type = helper.font(font)
+    width, height = helper.draw.textsize(text, font_type)
+    offset_x, offset_y = font_type.getoffset(text)
+    fullwidth = width + offset_x
+    fullheight = height + offset_y
+    r, g, b = fill
+
+    image = Image.new("1", (fullwidth, fullheight), color=0x000000)
+    draw = ImageDraw.Draw(image)
+    draw.text((0, 0), text, font=font_type, fill=0xFFFFFF)
+
+    image = image.convert("RGBA")
+    pixdata = image.load()
+    for y in range(fullheight):
+        for x in range(fullwidth):
+            if pixdata[x, y] == (0, 0, 0, 255):
+                pixdata[x, y] = (0, 0, 0, 0)
+            else:
+                pixdata[x, y] = (r, g, b, 255)
+
+    helper.img.paste(image, position, image)
+
+    return fullwidth, fullheight
+
+
+def main():
+    font_provider = FontProvider()
+    image = palette_image((640, 384), DrawHelper.WHITE)
+    helper = DrawHelper(
+        font_provider, ImageProvider(), TextProvider(font_provider), image
+    )
+
+    # The previous implementation drew on RGB images
+    legacy_image = Image.new(mode="RGB", size=(640, 384), color=0xFFFFFF)
+    legacy_helper = DrawHelper(
+        font_provider, ImageProvider(), TextProvider(font_provider), legacy_image
+    )
+
+    def run_legacy():
+        for text in TEXTS:
+            legacy_text(legacy_helper, (10, 10), text, FONT, (255, 0, 0))
+
+    def run_current():
+        for text in TEXTS:
+            helper.text((10, 10), text, font=FONT, fill=helper.COLOR)
+
+    # Warm up the font cache
+    run_legacy()
+
+    legacy = timeit.timeit(run_legacy, number=ITERATIONS) / ITERATIONS / len(TEXTS)
+    current = timeit.timeit(run_current, number=ITERATIONS) / ITERATIONS / len(TEXTS)
+
+    print(f"per-pixel loop : {legacy * 1e6:8.1f} us/call")
+    print(f"cached mask    : {current * 1e6:8.1f} us/call")
+    print(f"speedup        : {legacy / current:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
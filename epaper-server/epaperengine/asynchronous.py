@@ -1,8 +1,11 @@
+import io
 import time
 import logging
 import asyncio
+import hashlib
+from collections import deque
 from PIL import ImageChops
-from epaperengine.utils import random_string
+from epaperengine import framebuffer, metrics
 
 logger = logging.getLogger(__name__)
 
@@ -10,51 +13,236 @@ logger = logging.getLogger(__name__)
 # give time to the widgets to update and re-render
 TIME_MARGIN = 20
 
+# Number of previous versions from which a partial update can be served
+HISTORY_SIZE = 4
+
+# Seconds between two measures of the event loop lag
+LAG_INTERVAL = 1
+
+
+def image_version(image):
+    """ Returns a hash of the image content, identical images always get
+    the same version
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.width}x{image.height}:".encode("ascii"))
+    if image.mode == "P":
+        digest.update(bytes(image.getpalette()))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def encode_image(image):
+    """ Encodes the image as it is served to the displays
+    """
+    output = io.BytesIO()
+    image.save(output, format="PNG", bits=2, compress_level=9)
+    return output.getvalue()
+
+
+def encode_framebuffers(image):
+    """ Encodes the image in the native layout of the panel, raw and
+    run-length encoded
+    """
+    packed = framebuffer.pack(image)
+    return packed, framebuffer.compress(packed)
+
+
+def encode_deltas(history, image):
+    """ Encodes the region of the image which changed since each of the
+    previous versions, indexed by version
+    """
+    deltas = {}
+    for version, previous in history:
+        if previous.size != image.size:
+            continue
+
+        box = ImageChops.difference(previous, image).getbbox()
+        if box is not None:
+            deltas[version] = (box, encode_image(image.crop(box)))
+
+    return deltas
+
+
+class Frames:
+    """ The last frames published for a display, encoded in all the formats
+    served to the devices
+    """
+
+    def __init__(self):
+        self.image = None
+        self.version = None
+        self.data = None
+        self.framebuffers = None
+        self.deltas = {}
+        self.history = deque(maxlen=HISTORY_SIZE)
+
+    def publish(self, image):
+        """ Encodes the image if its content changed, returns whether a new
+        version was published
+        """
+        # The same image is returned when no widget changed
+        if image is self.image:
+            return False
+
+        self.image = image
+        version = image_version(image)
+        if version == self.version:
+            return False
+
+        # Encode once per version, the web server only serves the bytes
+        self.data = encode_image(image)
+        self.framebuffers = encode_framebuffers(image)
+        self.deltas = encode_deltas(list(self.history), image)
+        self.history.append((version, image))
+        self.version = version
 
-def images_equal(image_1, image_2):
-    # Initialization
-    if image_1 is None:
         return True
 
-    return ImageChops.difference(image_1, image_2).getbbox() is not None
+    def status(self, next_update):
+        return {
+            "version": self.version,
+            "image": self.image,
+            "data": self.data,
+            "length": len(self.data),
+            "framebuffer": self.framebuffers[0],
+            "framebuffer_rle": self.framebuffers[1],
+            "deltas": self.deltas,
+            "next_update": next_update,
+        }
+
+
+def render_frame(display, frames):
+    """ Renders the display and publishes the image, returns whether a new
+    version was published
+    """
+    # Only the changed widgets are redrawn
+    image = display.render_image()
 
+    start = time.perf_counter()
+    if not frames.publish(image):
+        return False
 
-async def display_updater(id, display):
-    current_image = None
-    image_version = None
+    display.timings["encode"] = time.perf_counter() - start
+    return True
 
+
+def record_timings(id, display):
+    """ Reports the stages run since the last update of the display
+    """
+    # An update which timed out may still write its timing from its thread
+    timings, display.timings = display.timings, {}
+    for stage, duration in timings.items():
+        kind, _, label = stage.partition(".")
+        if kind == "update":
+            metrics.widget_update_seconds.observe(duration, display=id, widget=label)
+        elif kind == "draw":
+            metrics.widget_draw_seconds.observe(duration, display=id, widget=label)
+        else:
+            metrics.render_stage_seconds.observe(duration, display=id, stage=stage)
+
+
+def record_frame_sizes(id, frames):
+    metrics.frame_bytes.set(len(frames.data), display=id, format="png")
+    metrics.frame_bytes.set(len(frames.framebuffers[0]), display=id, format="epd")
+    metrics.frame_bytes.set(len(frames.framebuffers[1]), display=id, format="epd-rle")
+
+
+async def monitor_event_loop():
+    """ Measures how late the event loop wakes up, a busy loop delays the
+    responses to the displays
+    """
     while True:
-        try:
-            # Load new image
-            logger.info(f"Updating display {id}")
-            loop = asyncio.get_running_loop()
-            new_image = await loop.run_in_executor(None, display.update_image)
-            logger.info(f"Loaded image for display {id}")
-
-            is_different = await loop.run_in_executor(
-                None, images_equal, current_image, new_image
-            )
+        start = time.monotonic()
+        await asyncio.sleep(LAG_INTERVAL)
+        lag = max(0, time.monotonic() - start - LAG_INTERVAL)
+        metrics.event_loop_lag_seconds.observe(lag)
+
+
+class DisplayUpdater:
+    """ Refreshes the widgets of a display which are due, renders it and
+    publishes the new frame. Each widget is refreshed on its own schedule.
+    """
+
+    def __init__(self, id, display, http, storage=None, pool=None):
+        self.id = id
+        self.display = display
+        self.http = http
+        self.storage = storage
+        self.pool = pool
+        self.frames = Frames()
+
+        # Monotonic times at which the widgets are due
+        self.next_updates = [0] * len(display.widgets)
 
-            if is_different:
-                image_version = random_string(32)
-                current_image = new_image
-                logger.info(f"Display {id} updated to version {image_version}")
-
-            # Update current image
-            display.set_status(
-                {
-                    "version": image_version,
-                    "image": current_image,
-                    "next_update": time.monotonic()
-                    + display.update_interval.total_seconds()
-                    + TIME_MARGIN,
-                }
+    async def restore(self):
+        """ Serves the last frame saved before the restart while the widgets
+        update
+        """
+        if self.storage is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        image = await loop.run_in_executor(None, self.storage.restore, self.display)
+        if image is not None:
+            await loop.run_in_executor(None, self.frames.publish, image)
+            self.display.set_status(self.frames.status(time.monotonic() + TIME_MARGIN))
+            logger.info(f"Restored display {self.id} to version {self.frames.version}")
+
+    def expire(self):
+        """ Makes all the widgets due
+        """
+        self.next_updates = [0] * len(self.display.widgets)
+
+    async def update(self):
+        """ Runs an update, returns the monotonic time of the next one
+        """
+        loop = asyncio.get_running_loop()
+        display = self.display
+        now = time.monotonic()
+
+        # Refresh the widgets that are due
+        due = [index for index, due_at in enumerate(self.next_updates) if due_at <= now]
+        logger.info(f"Updating {len(due)} widget(s) of display {self.id}")
+        failed = await display.update_widgets_async(self.http, due)
+        for index in failed:
+            metrics.widget_update_failures_total.inc(
+                display=self.id, widget=display.labels[index]
             )
-            await asyncio.sleep(display.update_interval.total_seconds())
-        except KeyboardInterrupt:
-            raise
-        except:
-            logger.exception(
-                f"Error while updating display {id}, retrying in 60 seconds"
+        for index in due:
+            interval = display.update_intervals[index].total_seconds()
+            self.next_updates[index] = now + interval
+
+        if self.storage is not None:
+            await loop.run_in_executor(None, self.storage.save_widgets, display)
+
+        # Load new image, in a worker process when a pool is used
+        if self.pool is not None:
+            published = await self.pool.render(self.id, display, self.frames)
+        else:
+            published = await loop.run_in_executor(
+                None, render_frame, display, self.frames
             )
-            await asyncio.sleep(60)
+        logger.info(f"Loaded image for display {self.id}")
+
+        if published:
+            logger.info(f"Display {self.id} updated to version {self.frames.version}")
+            record_frame_sizes(self.id, self.frames)
+            if self.storage is not None:
+                await loop.run_in_executor(
+                    None, self.storage.save_frame, self.frames.image
+                )
+
+        # Update current image, the displays come back once it can change
+        next_update = min(
+            self.next_updates, default=now + display.update_interval.total_seconds()
+        )
+        next_change = display.next_change(self.next_updates, next_update)
+        display.set_status(self.frames.status(next_change + TIME_MARGIN))
+        # A widget showing its previous data leaves the display stale
+        if not failed:
+            display.updated_at = time.monotonic()
+        record_timings(self.id, display)
+
+        # Render again when a widget changes without an update (at midnight)
+        return min(next_update, next_change)
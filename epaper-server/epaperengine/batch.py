@@ -0,0 +1,151 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw
+from epaperengine import helper, utils
+from epaperengine.display import Display
+from epaperengine.httpclient import HttpClient
+
+logger = logging.getLogger(__name__)
+
+# Layout of the contact sheet, the frames are scaled down by SHEET_REDUCTION
+SHEET_REDUCTION = 2
+SHEET_MARGIN = 20
+CAPTION_HEIGHT = 24
+CAPTION_FONT = ("OpenSans-Semibold-webfont.woff", 14)
+
+# Displays of the worker processes, indexed by display id
+worker_displays = {}
+
+
+def initialize_worker(configs):
+    for id, config in configs.items():
+        worker_displays[id] = Display(config)
+
+
+def render_in_worker(id, at, data, path):
+    """ Renders a display at a simulated time with the given widget data and
+    saves the frame as a PNG file
+    """
+    utils.simulated_now = at
+    display = worker_displays[id]
+    display.load_widgets(data)
+
+    # The tiles only depend on the date, the time of the frame may differ
+    display.invalidate()
+    display.render_image().save(path, format="PNG", compress_level=9)
+    return path
+
+
+async def fetch_data(displays, times):
+    """ Updates the widgets of the displays at each simulated time, returns
+    their data indexed by display id and time.
+
+    The responses are cached by the data sources, so a request shared by
+    several displays or times is only sent once. A display of which a
+    widget could not be updated at a time is not rendered at this time.
+    """
+    # The updates must end before the next simulated time, an update which
+    # timed out would keep running and read it
+    for display in displays.values():
+        display.timeouts = [None] * len(display.widgets)
+
+    data = {}
+    http = HttpClient()
+    try:
+        for at in times:
+            utils.simulated_now = at
+            results = await asyncio.gather(
+                *(display.update_widgets_async(http) for display in displays.values()),
+                return_exceptions=True,
+            )
+            for (id, display), result in zip(displays.items(), results):
+                if isinstance(result, Exception):
+                    logger.error(f"Could not update display {id} at {at}: {result}")
+                elif result:
+                    # Their data is from an earlier time
+                    labels = ", ".join(display.labels[index] for index in result)
+                    logger.error(f"Could not update display {id} at {at}: {labels}")
+                else:
+                    data[id, at] = display.dump_widgets()
+    finally:
+        utils.simulated_now = None
+        await http.close()
+
+    return data
+
+
+def frame_path(output, id, at):
+    return os.path.join(output, f"{id}-{at:%Y%m%dT%H%M%S}.png")
+
+
+def render_batch(configs, times, output, workers):
+    """ Renders each display at each simulated time in worker processes,
+    returns the paths of the frames indexed by display id and time
+    """
+    displays = {id: Display(config) for id, config in configs.items()}
+    data = asyncio.run(fetch_data(displays, times))
+    for display in displays.values():
+        display.close()
+
+    os.makedirs(output, exist_ok=True)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initialize_worker,
+        initargs=(configs,),
+    ) as executor:
+        futures = {
+            key: executor.submit(
+                render_in_worker, key[0], key[1], data[key], frame_path(output, *key)
+            )
+            for key in data
+        }
+
+        paths = {}
+        for (id, at), future in futures.items():
+            try:
+                paths[id, at] = future.result()
+            except Exception:
+                logger.exception(f"Could not render display {id} at {at}")
+
+    return paths
+
+
+def contact_sheet(paths, ids, times):
+    """ Returns an image of all the frames, a row per display and a column
+    per time
+    """
+    frames = {
+        key: Image.open(path).convert("RGB").reduce(SHEET_REDUCTION)
+        for key, path in paths.items()
+    }
+    cell_width = max((frame.width for frame in frames.values()), default=0)
+    cell_height = max((frame.height for frame in frames.values()), default=0)
+    cell_height += CAPTION_HEIGHT
+
+    sheet = Image.new(
+        "RGB",
+        (
+            SHEET_MARGIN + len(times) * (cell_width + SHEET_MARGIN),
+            SHEET_MARGIN + len(ids) * (cell_height + SHEET_MARGIN),
+        ),
+        color=(255, 255, 255),
+    )
+    draw = ImageDraw.Draw(sheet)
+    font = helper.fonts.get(*CAPTION_FONT)
+
+    for row, id in enumerate(ids):
+        for column, at in enumerate(times):
+            x = SHEET_MARGIN + column * (cell_width + SHEET_MARGIN)
+            y = SHEET_MARGIN + row * (cell_height + SHEET_MARGIN)
+            draw.text((x, y), f"{id} {at:%Y-%m-%d %H:%M %Z}", font=font, fill=0)
+
+            # Leave the cell empty if the frame could not be rendered
+            frame = frames.get((id, at))
+            if frame is not None:
+                sheet.paste(frame, (x, y + CAPTION_HEIGHT))
+
+    return sheet
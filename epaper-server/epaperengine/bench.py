@@ -0,0 +1,93 @@
+import json
+import time
+import resource
+import statistics
+from epaperengine import helper
+from epaperengine.asynchronous import encode_image, image_version
+
+
+def record_fixtures(display, path):
+    """ Fetches the data of the widgets and saves it as fixtures
+    """
+    display.update_widgets()
+    fixtures = [widget.dump_data() for widget, _, _ in display.widgets]
+
+    with open(path, "w") as fixtures_file:
+        json.dump(fixtures, fixtures_file)
+
+
+def load_fixtures(path):
+    with open(path) as fixtures_file:
+        return json.load(fixtures_file)
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(ratio * (len(values) - 1)))]
+
+
+def run_benchmark(display, fixtures, iterations):
+    """ Renders the display the given number of times using the fixtures
+    instead of fetching data, returns statistics on each stage in seconds
+    """
+    samples = {}
+
+    def measure(stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        samples.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    for _ in range(iterations):
+        display.invalidate()
+        display.timings.clear()
+
+        # Update from the fixtures
+        for index, (widget, _, _) in enumerate(display.widgets):
+            if fixtures[index] is not None:
+                stage = f"update.{display.labels[index]}"
+                measure(stage, widget.load_data, fixtures[index])
+
+        # Draw, composite and rotate
+        image = measure("render", display.render_image)
+        for stage, duration in display.timings.items():
+            samples.setdefault(stage, []).append(duration)
+
+        measure("encode", encode_image, image)
+        measure("change_detection", image_version, image)
+
+    return {
+        "iterations": iterations,
+        "stages": {
+            stage: {
+                "min": min(values),
+                "median": statistics.median(values),
+                "p95": percentile(values, 0.95),
+            }
+            for stage, values in samples.items()
+        },
+        "text_metrics": {
+            "hits": helper.text_metrics.hits,
+            "misses": helper.text_metrics.misses,
+        },
+        # Kilobytes on Linux
+        "peak_memory": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def format_results(results):
+    columns = ("min", "median", "p95")
+    lines = [f"{'stage':<32}" + "".join(f" {column:>10}" for column in columns)]
+    for stage, values in results["stages"].items():
+        timings = "".join(f" {values[column] * 1000:>8.2f}ms" for column in columns)
+        lines.append(f"{stage:<32}{timings}")
+    text_metrics = results["text_metrics"]
+    lookups = text_metrics["hits"] + text_metrics["misses"]
+    if lookups:
+        lines.append(
+            f"Text metrics: {text_metrics['hits'] / lookups:.1%} hits "
+            f"({text_metrics['misses']} texts measured)"
+        )
+    lines.append(f"Peak memory: {results['peak_memory'] / 1024:.1f} MiB")
+
+    return "\n".join(lines)
@@ -1,12 +1,37 @@
+import time
+import asyncio
 import logging
-from PIL import Image, ImageChops, ImagePalette
-from datetime import timedelta
-from epaperengine import widgets
-from epaperengine.utils import parse_dimensions, parse_position
-from epaperengine.helper import DrawHelper, FontProvider, ImageProvider
+from datetime import timezone
+from concurrent.futures import ThreadPoolExecutor
+from epaperengine import utils, widgets
+from epaperengine.httpclient import HttpClient
+from epaperengine.widgets.base import BaseWidget
+from epaperengine.utils import parse_dimensions, parse_duration, parse_position
+from epaperengine.helper import (
+    DrawHelper,
+    TextProvider,
+    WHITE,
+    fonts,
+    images,
+    palette_image,
+    preload,
+)
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of seconds to wait for a widget update before drawing it
+# with its previous data
+DEFAULT_WIDGET_TIMEOUT = 30
+
+
+def overlaps(box_1, box_2):
+    return (
+        box_1[0] < box_2[2]
+        and box_2[0] < box_1[2]
+        and box_1[1] < box_2[3]
+        and box_2[1] < box_1[3]
+    )
+
 
 class Display:
     def __init__(self, config):
@@ -14,9 +39,15 @@ class Display:
         self.width = dimensions[0]
         self.height = dimensions[1]
         self.widgets = []
-        self.update_interval = timedelta(seconds=config["updateEvery"])
+        self.update_interval = parse_duration(config["updateEvery"])
+        self.update_intervals = []
         self.status = None
+        # Monotonic time of the last successful update
+        self.updated_at = None
         self.rotate = config.get("rotate", 0)
+        self.labels = []
+        self.timeouts = []
+        widget_timeout = config.get("widgetTimeout", DEFAULT_WIDGET_TIMEOUT)
 
         # Create widgets
         settings = config["settings"]
@@ -27,36 +58,237 @@ class Display:
 
             widget_obj = widget_class({**settings, **widget_settings}, size)
 
-            self.widgets.append((widget_obj, parse_position(widget["position"]), size))
+            position = tuple(parse_position(widget["position"]))
+            self.widgets.append((widget_obj, position, size))
+            self.labels.append(f"{widget['widget']}#{len(self.labels)}")
+            self.timeouts.append(widget.get("timeout", widget_timeout))
+            self.update_intervals.append(
+                parse_duration(widget.get("updateEvery", config["updateEvery"]))
+            )
+
+        # Widgets are updated in parallel, a slow widget keeps its slot until
+        # its pending update finishes
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, len(self.widgets)), thread_name_prefix="widget"
+        )
+        self.updates = {}
+        self.updated = set()
+
+        # Fonts and icons are shared by all the displays
+        self.font_provider = fonts
+        self.image_provider = images
+        self.text_provider = TextProvider(fonts)
+        preload(widget for widget, _, _ in self.widgets)
+
+        # Last rendered state, widget tiles are indexed by widget position
+        self.tiles = {}
+        self.canvas = None
+        self.frame = None
+
+        # Duration in seconds of the last run of each stage
+        self.timings = {}
+
+    def close(self):
+        """ Stops the threads of the display, the pending updates end in
+        the background
+        """
+        self.executor.shutdown(wait=False)
+
+    def invalidate(self):
+        """ Forgets the rendered widgets, the next render redraws everything
+        """
+        self.tiles = {}
+        self.canvas = None
+        self.frame = None
+
+    def dump_widgets(self):
+        """ Returns the data of the updated widgets, indexed by label
+        """
+        return {
+            self.labels[index]: self.widgets[index][0].dump_data()
+            for index in sorted(self.updated)
+        }
+
+    def load_widgets(self, data):
+        """ Restores the data returned by dump_widgets, the widgets then
+        fall back to it if their next update fails
+        """
+        for index, label in enumerate(self.labels):
+            if data.get(label) is not None:
+                self.widgets[index][0].load_data(data[label])
+                self.updated.add(index)
+
+    def _update_widget(self, index):
+        start = time.perf_counter()
+        self.widgets[index][0].update()
+        self.timings[f"update.{self.labels[index]}"] = time.perf_counter() - start
+
+    async def _update_widget_async(self, index, http):
+        start = time.perf_counter()
+        await self.widgets[index][0].update_async(http)
+        self.timings[f"update.{self.labels[index]}"] = time.perf_counter() - start
+
+    def _start_update(self, index, http):
+        widget = self.widgets[index][0]
+        if type(widget).update_async is not BaseWidget.update_async:
+            return asyncio.ensure_future(self._update_widget_async(index, http))
+
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor, self._update_widget, index)
+
+    def update_widgets(self, indexes=None):
+        """ Updates the data of the widgets at the given indexes, or of
+        all the widgets, outside of an event loop
+        """
+
+        async def update():
+            http = HttpClient()
+            try:
+                await self.update_widgets_async(http, indexes)
+            finally:
+                await http.close()
+
+        asyncio.run(update())
 
-        # Initialize caches
-        self.font_provider = FontProvider()
-        self.image_provider = ImageProvider()
+    async def update_widgets_async(self, http, indexes=None):
+        """ Updates the data of the widgets at the given indexes, or of
+        all the widgets. The widgets implementing update_async fetch their
+        data with the shared HTTP client, the others run in a thread.
+
+        Returns the indexes of the widgets which kept their previous data.
+        A widget of which the timeout is None is always waited for.
+        """
+        if indexes is None:
+            indexes = range(len(self.widgets))
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        failed = []
+
+        # Start the updates, except for the widgets still being updated
+        for index in indexes:
+            future = self.updates.get(index)
+            if future is None or future.done() or future.get_loop() is not loop:
+                self.updates[index] = self._start_update(index, http)
+
+        # Wait for the updates, falling back to the last data if any
+        for index in indexes:
+            widget = self.widgets[index][0]
+            future = self.updates[index]
+            timeout = self.timeouts[index]
+            if timeout is not None:
+                timeout = max(0, start + timeout - time.monotonic())
+
+            # The update goes on after the timeout, until the next one. A
+            # TimeoutError raised by the widget itself is an error.
+            await asyncio.wait([future], timeout=timeout)
+            if not future.done():
+                message = (
+                    f"{type(widget).__name__} did not update within "
+                    f"{self.timeouts[index]} seconds"
+                )
+                if index not in self.updated:
+                    raise TimeoutError(message)
+                failed.append(index)
+                logger.warning(f"{message}, using previous data")
+                continue
+
+            try:
+                future.result()
+                self.updated.add(index)
+            except Exception:
+                if index not in self.updated:
+                    raise
+                failed.append(index)
+                logger.exception(
+                    f"Error while updating {type(widget).__name__}, using previous data"
+                )
+
+        return failed
+
+    def next_change(self, next_updates, default):
+        """ Returns the monotonic time at which the image can change next,
+        given the monotonic times of the next updates of the widgets. A widget
+        changes at its next update, or later if it knows its data is fresh,
+        and at its next change without new data if it comes before (midnight).
+        """
+        now = time.monotonic()
+        wall_now = utils.now(timezone.utc)
+
+        def monotonic(at):
+            return now + (at - wall_now).total_seconds()
+
+        changes = []
+        for index, (widget, _, _) in enumerate(self.widgets):
+            change = next_updates[index]
+
+            expires_at = widget.data_expires_at()
+            if expires_at is not None:
+                change = max(change, monotonic(expires_at))
+
+            change_at = widget.next_change()
+            if change_at is not None:
+                change = min(change, monotonic(change_at))
+
+            changes.append(change)
+
+        return min(changes, default=default)
 
     def update_image(self):
         logger.info("Updating widgets...")
-        for widget, _, _ in self.widgets:
-            widget.update()
+        self.update_widgets()
 
-        logger.info("Create image...")
-        image = Image.new(mode="RGB", size=(self.width, self.height), color=0xFFFFFF)
+        return self.render_image()
 
-        for widget, position, size in self.widgets:
-            # Create image
-            widget_image = Image.new(mode="RGB", size=size, color=0xFFFFFF)
-            helper = DrawHelper(self.font_provider, self.image_provider, widget_image)
+    def render_image(self):
+        # Redraw only the widgets whose data changed since the last image
+        changed = set()
+        for index, (widget, position, size) in enumerate(self.widgets):
+            fingerprint = widget.fingerprint()
+            tile = self.tiles.get(index)
+            if tile is not None and fingerprint is not None and tile[0] == fingerprint:
+                continue
+
+            widget_image = palette_image(size, WHITE)
+            helper = DrawHelper(
+                self.font_provider,
+                self.image_provider,
+                self.text_provider,
+                widget_image,
+            )
+            start = time.perf_counter()
             widget.draw(helper)
+            self.timings[f"draw.{self.labels[index]}"] = time.perf_counter() - start
+
+            self.tiles[index] = (fingerprint, widget_image)
+            changed.add(index)
 
-            # Paste image into the main image
-            image.paste(widget_image, position)
+        if not changed and self.frame is not None:
+            logger.info("No widget changed, reusing image")
+            return self.frame
+
+        logger.info("Create image...")
+        start = time.perf_counter()
+        if self.canvas is None:
+            self.canvas = palette_image((self.width, self.height), WHITE)
 
-        # Convert image with the right palette
-        pal_img = Image.new("P", (1, 1))
-        pal_img.putpalette([0, 0, 0, 255, 255, 255, 255, 0, 0, 0, 0, 0] * 64)
+        # Paste the changed widgets, and the ones drawn over them to keep
+        # the stacking order
+        pasted = []
+        for index, (_, position, size) in enumerate(self.widgets):
+            x, y = position
+            box = (x, y, x + size[0], y + size[1])
+            if index in changed or any(overlaps(box, other) for other in pasted):
+                self.canvas.paste(self.tiles[index][1], position)
+                pasted.append(box)
+        self.timings["composite"] = time.perf_counter() - start
 
-        return image.rotate(self.rotate, expand=True).quantize(palette=pal_img)
+        # The canvas already has the palette of the display, the rotation
+        # returns a copy which is not modified by the next renders
+        start = time.perf_counter()
+        self.frame = self.canvas.rotate(self.rotate, expand=True)
+        self.timings["rotate"] = time.perf_counter() - start
 
-        # return image.quantize(colors=3, palette=[0, 0, 0, 255, 255, 255, 255, 0, 0])
+        return self.frame
 
     def set_status(self, status):
         self.status = status
@@ -0,0 +1,95 @@
+import copy
+import asyncio
+import logging
+from epaperengine import metrics
+from epaperengine.display import Display
+from epaperengine.storage import DisplayStorage
+from epaperengine.renderpool import RenderPool
+from epaperengine.asynchronous import DisplayUpdater
+from epaperengine.scheduler import MAX_CONCURRENT_UPDATES, Scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class Fleet:
+    """ Runs the displays of the configuration. A new configuration only
+    restarts the displays whose configuration changed, the others keep
+    their data and their frames.
+    """
+
+    def __init__(
+        self,
+        context,
+        http,
+        cache_dir=None,
+        render_workers=0,
+        max_updates=MAX_CONCURRENT_UPDATES,
+    ):
+        self.context = context
+        self.http = http
+        self.cache_dir = cache_dir
+        self.scheduler = Scheduler(max_updates)
+        self.configs = {}
+        self.lock = asyncio.Lock()
+
+        # Render in worker processes instead of threads if requested
+        self.pool = RenderPool(render_workers) if render_workers > 0 else None
+
+    async def _start(self, id, config, display):
+        storage = DisplayStorage(self.cache_dir, id) if self.cache_dir else None
+        if self.pool is not None:
+            self.pool.set_display(id, config)
+        updater = DisplayUpdater(id, display, self.http, storage, self.pool)
+
+        previous = self.context.displays.get(id)
+        if previous is None:
+            # Serve the frame saved before the restart while the widgets update
+            await updater.restore()
+            self.scheduler.add(id, updater)
+        else:
+            # Serve the previous frame until the first update
+            display.set_status(previous.get_status())
+            self.scheduler.add(id, updater, delay=0)
+            previous.close()
+
+        self.context.add_display(id, display)
+
+    def _stop(self, id):
+        self.scheduler.remove(id)
+        self.context.remove_display(id).close()
+        if self.pool is not None:
+            self.pool.remove_display(id)
+        metrics.forget_display(id)
+
+    async def load(self, config):
+        """ Applies the configuration, returns the ids of the displays which
+        were started and of the ones which were removed
+        """
+        async with self.lock:
+            displays = config["displays"]
+            started = [
+                id
+                for id, display_config in displays.items()
+                if self.configs.get(id) != display_config
+            ]
+            removed = [id for id in self.configs if id not in displays]
+
+            # Fail before changing anything if a configuration is invalid
+            new_displays = {id: Display(displays[id]) for id in started}
+
+            # The displays are started before their tokens are valid
+            for id in started:
+                await self._start(id, displays[id], new_displays[id])
+            self.context.set_tokens(dict(config["tokens"]))
+            for id in removed:
+                self._stop(id)
+
+            self.configs = copy.deepcopy(displays)
+            return started, removed
+
+    def start(self):
+        self.scheduler.start()
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
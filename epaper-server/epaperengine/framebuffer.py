@@ -0,0 +1,26 @@
+import re
+from PIL import Image
+
+# Values of the black, white and color pixels sent to the panel, indexed by
+# the position of the color in the palette (repeated every 4 entries)
+PANEL_VALUES = [0x0, 0x3, 0x4, 0x0]
+INDEX_TO_PANEL = bytes(PANEL_VALUES[index % 4] for index in range(256))
+
+# Runs of up to 255 identical bytes
+RUNS = re.compile(rb"(.)\1{0,254}", re.DOTALL)
+
+
+def pack(image):
+    """ Packs a palette image in the layout of the panel: 4 bits per pixel,
+    two pixels per byte with the first one in the high bits, row by row
+    """
+    values = image.tobytes().translate(INDEX_TO_PANEL)
+    return Image.frombytes("P", image.size, values).tobytes("raw", "P;4")
+
+
+def compress(data):
+    """ Run-length encodes the data as (count, value) pairs of bytes
+    """
+    return b"".join(
+        bytes((len(run.group()), run.group()[0])) for run in RUNS.finditer(data)
+    )
@@ -1,10 +1,54 @@
+import os
 import math
+import threading
+from collections import OrderedDict
 from PIL import Image, ImageFont, ImageDraw, ImageColor
+from epaperengine.metrics import text_metrics_lookups_total
+
+# Independent of the working directory
+RESOURCES_DIRECTORY = os.path.join(os.path.dirname(__file__), "resources")
+FONTS_DIRECTORY = os.path.join(RESOURCES_DIRECTORY, "fonts")
+IMAGES_DIRECTORY = os.path.join(RESOURCES_DIRECTORY, "images")
+
+# Black, white and color, repeated to fill the 256 entries of the palette
+PALETTE = [0, 0, 0, 255, 255, 255, 255, 0, 0, 0, 0, 0] * 64
+BLACK = 0
+WHITE = 1
+COLOR = 2
+
+# Gray levels of the monochrome images mapped to the nearest color
+GRAY_TO_INDEX = [BLACK] * 128 + [WHITE] * 128
+
+# Opacity of the transparent images mapped to a mask without blending
+ALPHA_TO_MASK = [0] * 128 + [255] * 128
+
+
+def palette_image(size=(1, 1), color=BLACK):
+    """ Returns a new image drawn directly with the indexes of the colors
+    of the display
+    """
+    image = Image.new("P", size, color=color)
+    image.putpalette(PALETTE)
+    return image
+
+
+def to_indexes(image):
+    """ Converts an image to the palette of the display, monochrome images
+    through a lookup table
+    """
+    if image.mode in ("1", "L"):
+        indexes = image.convert("L").point(GRAY_TO_INDEX)
+        image = Image.frombytes("P", image.size, indexes.tobytes())
+        image.putpalette(PALETTE)
+        return image
+
+    return image.convert("RGB").quantize(palette=palette_image())
 
 
 class FontProvider:
     def __init__(self):
         self.cache = {}
+        self.lock = threading.Lock()
 
     def get(self, name, fontsize):
         # Load from cache
@@ -12,40 +56,177 @@ class FontProvider:
         if font is not None:
             return font
 
-        # Create new font
-        font = ImageFont.truetype(
-            "epaperengine/resources/fonts/{}".format(name), fontsize
-        )
-        self.cache[(name, fontsize)] = font
+        # Create new font, once when several threads need it
+        with self.lock:
+            font = self.cache.get((name, fontsize))
+            if font is None:
+                path = os.path.join(FONTS_DIRECTORY, name)
+                font = self.cache[(name, fontsize)] = ImageFont.truetype(path, fontsize)
 
         return font
 
+    def memory_usage(self):
+        """ Returns an estimate in bytes, the size of the loaded font files
+        """
+        # The sizes of a font share its file
+        return sum(
+            os.path.getsize(os.path.join(FONTS_DIRECTORY, name))
+            for name in {name for name, _ in list(self.cache)}
+        )
+
 
 class ImageProvider:
+    """ Keeps the images converted to the palette of the display, with a
+    mask for the transparent ones
+    """
+
     def __init__(self):
         self.cache = {}
+        self.lock = threading.Lock()
+
+    def _load(self, name):
+        with self.lock:
+            entry = self.cache.get(name)
+            if entry is not None:
+                return entry
+
+            source = Image.open(os.path.join(IMAGES_DIRECTORY, name))
+            mask = None
+            if source.mode in ("RGBA", "LA") or "transparency" in source.info:
+                source = source.convert("RGBA")
+                mask = source.getchannel("A").point(ALPHA_TO_MASK)
+
+            entry = self.cache[name] = (to_indexes(source), mask)
+            return entry
 
     def get(self, name):
-        image = self.cache.get(name)
-        if image is not None:
-            return image
+        entry = self.cache.get(name) or self._load(name)
+        return entry[0]
 
-        image = Image.open("epaperengine/resources/images/{}".format(name))
-        self.cache[name] = image
+    def mask(self, name):
+        """ Returns the mask of a transparent image, None if it is opaque
+        """
+        entry = self.cache.get(name) or self._load(name)
+        return entry[1]
 
-        return image
+    def memory_usage(self):
+        # One byte per pixel for the image and the mask
+        return sum(
+            image.width * image.height * (1 if mask is None else 2)
+            for image, mask in list(self.cache.values())
+        )
+
+
+class TextMetrics:
+    """ Keeps the layout of the most recently measured texts, indexed by
+    text, font name and font size, as the size returned by textsize and
+    the offset of the first glyph.
+
+    Measuring a text lays it out, which costs about as much as drawing it.
+    """
+
+    def __init__(self, font_provider, max_size=4096):
+        self.cache = OrderedDict()
+        self.max_size = max_size
+        self.font_provider = font_provider
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, font):
+        """ Returns the width, height, horizontal and vertical offset of a
+        text drawn with the font settings
+        """
+        key = (text, *font)
+        with self.lock:
+            metrics = self.cache.get(key)
+            if metrics is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                text_metrics_lookups_total.inc(result="hit")
+                return metrics
+
+        font_type = self.font_provider.get(*font)
+        metrics = (*font_type.getsize(text), *font_type.getoffset(text))
+
+        with self.lock:
+            self.misses += 1
+            text_metrics_lookups_total.inc(result="miss")
+            self.cache[key] = metrics
+
+            # Evict the least recently used text
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+        return metrics
+
+
+# Shared by all the displays of the process
+fonts = FontProvider()
+images = ImageProvider()
+text_metrics = TextMetrics(fonts)
+
+
+def preload(widgets):
+    """ Loads the fonts and the icons used by the widgets, so that the first
+    render does not read them from the disk
+    """
+    for widget in widgets:
+        for font in widget.fonts.values():
+            fonts.get(*font)
+        for icon in widget.icons:
+            images.get(icon)
+
+
+def memory_usage():
+    """ Returns the memory used by the shared fonts and icons in bytes
+    """
+    return {"fonts": fonts.memory_usage(), "icons": images.memory_usage()}
+
+
+class TextProvider:
+    """ Keeps the most recently rendered texts as 1-bit masks, indexed
+    by text, font name and font size
+    """
+
+    def __init__(self, font_provider, max_size=1024):
+        self.cache = OrderedDict()
+        self.max_size = max_size
+        self.font_provider = font_provider
+
+    def get(self, text, font, size):
+        key = (text, *font)
+        mask = self.cache.get(key)
+        if mask is not None:
+            self.cache.move_to_end(key)
+            return mask
+
+        # Draw the text into a new mask
+        mask = Image.new("1", size, color=0)
+        draw = ImageDraw.Draw(mask)
+        draw.text((0, 0), text, font=self.font_provider.get(*font), fill=1)
+        self.cache[key] = mask
+
+        # Evict the least recently used text
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+        return mask
 
 
 class DrawHelper:
-    BLACK = (0, 0, 0)
-    WHITE = (255, 255, 255)
-    COLOR = (255, 0, 0)
+    BLACK = BLACK
+    WHITE = WHITE
+    COLOR = COLOR
 
-    def __init__(self, font_provider, image_provider, image):
+    def __init__(self, font_provider, image_provider, text_provider, image):
         self.img = image
         self.draw = ImageDraw.Draw(image)
         self.font_provider = font_provider
         self.image_provider = image_provider
+        self.text_provider = text_provider
+        # Shared with the other displays, the layout only depends on the font
+        self.text_metrics = text_metrics
 
     def font(self, settings):
         return self.font_provider.get(*settings)
@@ -53,18 +234,29 @@ class DrawHelper:
     def image(self, name):
         return self.image_provider.get(name)
 
+    def paste_image(self, name, position):
+        """ Pastes an image at its top left position, through its mask if it
+        is transparent
+        """
+        self.img.paste(self.image(name), position, self.image_provider.mask(name))
+
     def image_centered(self, name, position):
         image = self.image(name)
 
         x = math.floor(position[0] - image.width / 2)
         y = math.floor(position[1] - image.height / 2)
 
-        self.img.paste(image, (x, y))
+        self.paste_image(name, (x, y))
+
+    def textsize(self, text, font):
+        """ Returns the size of a text like ImageDraw.textsize, measured
+        once per process
+        """
+        width, height, _, _ = self.text_metrics.get(text, font)
+        return width, height
 
     def text_centered(self, text, font, position, **params):
-        font_type = self.font(font)
-        width, height = self.draw.textsize(text, font_type)
-        offset_x, offset_y = font_type.getoffset(text)
+        width, height, offset_x, offset_y = self.text_metrics.get(text, font)
 
         x = math.floor(position[0] - (width + offset_x) / 2)
         y = math.floor(position[1] - (height + offset_y) / 2)
@@ -74,40 +266,18 @@ class DrawHelper:
     def text(self, position, text, font, fill):
         """ Draws a text and returns if width and height.
 
-        The final dithering applied on the image plays badly
-        with text.
-
-        The solution is to draw the thex into a temporary monochrome image,
-        convert the colors into a transparent image with the correct color
-        and paste it into the 
+        The image only holds the colors of the display, so the text is
+        drawn into a monochrome mask (cached by the text provider) and
+        the requested color is pasted through this mask, so that no
+        intermediate color is introduced.
         """
-        # Get font and size
-        font_type = self.font(font)
-        width, height = self.draw.textsize(text, font_type)
-        offset_x, offset_y = font_type.getoffset(text)
+        # Get the size from the measured texts
+        width, height, offset_x, offset_y = self.text_metrics.get(text, font)
         fullwidth = width + offset_x
         fullheight = height + offset_y
 
-        # Convert color
-        r, g, b = fill
-
-        # Create temporary image and add text
-        image = Image.new("1", (fullwidth, fullheight), color=0x000000)
-        draw = ImageDraw.Draw(image)
-        draw.text((0, 0), text, font=font_type, fill=0xFFFFFF)
-
-        # Convert image to transparent and replace colors
-        image = image.convert("RGBA")
-        pixdata = image.load()
-        for y in range(fullheight):
-            for x in range(fullwidth):
-                # Replace black background with transparent
-                if pixdata[x, y] == (0, 0, 0, 255):
-                    pixdata[x, y] = (0, 0, 0, 0)
-                # Replace white with requested color
-                else:
-                    pixdata[x, y] = (r, g, b, 255)
-
-        self.img.paste(image, position, image)
+        # Paste the color through the mask of the text
+        mask = self.text_provider.get(text, font, (fullwidth, fullheight))
+        self.img.paste(fill, position, mask)
 
         return fullwidth, fullheight
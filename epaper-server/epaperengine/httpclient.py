@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import aiohttp
+from urllib.parse import urlsplit
+from epaperengine import metrics
+
+logger = logging.getLogger(__name__)
+
+# Timeout in seconds of the HTTP requests made to the upstream APIs
+HTTP_TIMEOUT = 20
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    """ HTTP session shared by all the widgets fetching their data without
+    blocking, keeping the connections alive and caching the DNS queries.
+
+    Failed requests are retried with an exponential backoff.
+    """
+
+    def __init__(self, retries=RETRIES, backoff=RETRY_BACKOFF):
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+
+    def _get_session(self):
+        # The session must be created from the event loop
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=100, ttl_dns_cache=300, keepalive_timeout=60
+                ),
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            )
+
+        return self.session
+
+    async def get(self, url, params=None, headers=None):
+        """ Returns the status, the headers and the body of the response
+        """
+        attempt = 0
+        while True:
+            try:
+                async with self._get_session().get(
+                    url, params=params, headers=headers
+                ) as response:
+                    if response.status in RETRY_STATUSES and attempt < self.retries:
+                        error = f"status {response.status}"
+                    else:
+                        response.raise_for_status()
+                        return response.status, response.headers, await response.read()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries:
+                    raise
+                error = repr(e)
+
+            delay = self.backoff * 2 ** attempt
+            logger.warning(f"Request to {url} failed ({error}), retrying in {delay}s")
+            metrics.http_retries_total.inc(host=urlsplit(url).hostname)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,191 @@
+import math
+import threading
+
+# Upper bounds in seconds of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+registry = []
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Metric:
+    """ A metric in the Prometheus text format, with one value per
+    combination of labels
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def remove(self, **labels):
+        """ Forgets the values of which the labels include the given ones
+        """
+        with self.lock:
+            for key in list(self.values):
+                values = dict(zip(self.labels, key))
+                if all(values[name] == value for name, value in labels.items()):
+                    del self.values[key]
+
+    def samples(self):
+        with self.lock:
+            return [
+                (self.name, format_labels(self.labels, key), value)
+                for key, value in self.values.items()
+            ]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(
+            f"{name}{labels} {format_value(value)}"
+            for name, labels, value in self.samples()
+        )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                for bound, count in zip(self.buckets, counts):
+                    labels = format_labels(
+                        self.labels, key, [("le", format_value(bound))]
+                    )
+                    samples.append((f"{self.name}_bucket", labels, count))
+
+                labels = format_labels(self.labels, key)
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, counts[-1]))
+
+        return samples
+
+
+def forget_display(id):
+    """ Removes the values of a display which no longer exists
+    """
+    for metric in registry:
+        if "display" in metric.labels:
+            metric.remove(display=id)
+
+
+def render():
+    """ Returns all the metrics in the Prometheus text exposition format
+    """
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+widget_update_seconds = Histogram(
+    "epaper_widget_update_seconds",
+    "Time spent fetching the data of a widget",
+    ["display", "widget"],
+)
+widget_draw_seconds = Histogram(
+    "epaper_widget_draw_seconds", "Time spent drawing a widget", ["display", "widget"]
+)
+render_stage_seconds = Histogram(
+    "epaper_render_stage_seconds",
+    "Time spent compositing, rotating, quantizing and encoding a frame",
+    ["display", "stage"],
+)
+frame_bytes = Gauge(
+    "epaper_frame_bytes", "Size of the last encoded frame", ["display", "format"]
+)
+responses_total = Counter(
+    "epaper_responses_total",
+    "Responses sent to the displays",
+    ["display", "route", "status"],
+)
+widget_update_failures_total = Counter(
+    "epaper_widget_update_failures_total",
+    "Widget updates which failed or timed out",
+    ["display", "widget"],
+)
+display_update_failures_total = Counter(
+    "epaper_display_update_failures_total",
+    "Display updates which failed and were retried later",
+    ["display"],
+)
+http_retries_total = Counter(
+    "epaper_http_retries_total", "Upstream HTTP requests retried", ["host"]
+)
+last_update_age_seconds = Gauge(
+    "epaper_last_update_age_seconds",
+    "Time since the last successful update of a display",
+    ["display"],
+)
+resources_bytes = Gauge(
+    "epaper_resources_bytes", "Memory used by the shared fonts and icons", ["kind"]
+)
+text_metrics_lookups_total = Counter(
+    "epaper_text_metrics_lookups_total",
+    "Lookups of the text layouts measured by the process, by result",
+    ["result"],
+)
+event_loop_lag_seconds = Histogram(
+    "epaper_event_loop_lag_seconds",
+    "Delay of the event loop in running a scheduled callback",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
@@ -0,0 +1,62 @@
+import os
+import json
+import logging
+from epaperengine.utils import hash_data
+
+logger = logging.getLogger(__name__)
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+class MissingFixture(LookupError):
+    pass
+
+
+class Recorder:
+    """ Saves the data fetched from the upstream APIs into a directory, or
+    serves it from this directory instead of fetching it, after an
+    artificial latency in seconds.
+
+    Each fetch is saved in a file named after its kind and a hash of its
+    parameters, as JSON or as raw bytes for the images.
+    """
+
+    def __init__(self, directory, mode, latency=0):
+        self.directory = directory
+        self.mode = mode
+        self.latency = latency
+        if mode == RECORD:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    def _path(self, key, extension):
+        # The parameters include the API keys, which are not saved
+        return os.path.join(self.directory, f"{key[0]}-{hash_data(*key)}{extension}")
+
+    def save(self, key, value):
+        if self.mode != RECORD:
+            return
+
+        if isinstance(value, bytes):
+            with open(self._path(key, ".bin"), "wb") as fixture_file:
+                fixture_file.write(value)
+        else:
+            with open(self._path(key, ".json"), "w") as fixture_file:
+                json.dump(value, fixture_file)
+
+    def load(self, key):
+        path = self._path(key, ".json")
+        if os.path.exists(path):
+            with open(path) as fixture_file:
+                return json.load(fixture_file)
+
+        path = self._path(key, ".bin")
+        if os.path.exists(path):
+            with open(path, "rb") as fixture_file:
+                return fixture_file.read()
+
+        raise MissingFixture(f"No {key[0]} response recorded in {self.directory}")
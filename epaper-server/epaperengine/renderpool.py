@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from epaperengine import helper, metrics
+from epaperengine.display import Display
+from epaperengine.asynchronous import Frames, render_frame
+
+logger = logging.getLogger(__name__)
+
+# State of the worker processes, indexed by display id
+worker_displays = {}
+worker_frames = {}
+
+
+def configure_worker(id, config):
+    """ Creates the display in the worker, or removes it if config is None
+    """
+    worker_displays.pop(id, None)
+    worker_frames.pop(id, None)
+    if config is not None:
+        worker_displays[id] = Display(config)
+        worker_frames[id] = Frames()
+
+
+def initialize_worker(configs):
+    for id, config in configs.items():
+        configure_worker(id, config)
+
+
+def render_in_worker(id, data):
+    """ Loads the data of the widgets which changed, renders the display
+    and returns the encoded frame if it changed, with the timings and the
+    number of text metrics lookups by result
+    """
+    display = worker_displays[id]
+    display.load_widgets(data)
+    display.timings.clear()
+    hits, misses = helper.text_metrics.hits, helper.text_metrics.misses
+
+    frames = worker_frames[id]
+    frame = None
+    if render_frame(display, frames):
+        frame = (
+            frames.version,
+            frames.image,
+            frames.data,
+            frames.framebuffers,
+            frames.deltas,
+        )
+
+    lookups = {
+        "hit": helper.text_metrics.hits - hits,
+        "miss": helper.text_metrics.misses - misses,
+    }
+    return frame, display.timings, lookups
+
+
+class RenderPool:
+    """ Renders the displays in worker processes instead of threads, so that
+    the rendering of a large fleet is not limited by the GIL.
+
+    Each display is always rendered by the same worker, which keeps its
+    widget tiles and its previous frames. Only the data of the widgets is
+    sent to the workers, which send back the encoded frames.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.configs = {}
+        self.shards = {}
+        self.executors = [self._create_executor(shard) for shard in range(workers)]
+
+        # Fingerprints of the widget data sent to the workers
+        self.sent = {}
+
+    def _create_executor(self, shard):
+        configs = {
+            id: config
+            for id, config in self.configs.items()
+            if self.shards[id] == shard
+        }
+        # Forking the event loop and its threads is not safe
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initialize_worker,
+            initargs=(configs,),
+        )
+
+    def set_display(self, id, config):
+        """ Adds a display or replaces its configuration, the worker starts
+        over with the new one
+        """
+        if id not in self.shards:
+            # Assign the new display to the worker with the fewest displays
+            loads = [
+                list(self.shards.values()).count(shard) for shard in range(self.workers)
+            ]
+            self.shards[id] = loads.index(min(loads))
+
+        self.configs[id] = config
+        self.sent.pop(id, None)
+        self._configure(self.shards[id], id, config)
+
+    def remove_display(self, id):
+        shard = self.shards.pop(id)
+        del self.configs[id]
+        self.sent.pop(id, None)
+        self._configure(shard, id, None)
+
+    def _configure(self, shard, id, config):
+        try:
+            self.executors[shard].submit(configure_worker, id, config)
+        except BrokenProcessPool:
+            # The next render restarts the worker with the new configuration
+            pass
+
+    def _changed_data(self, id, display):
+        """ Returns the data of the widgets which changed since it was last
+        sent to the worker, and the fingerprints of all the widgets
+        """
+        sent = self.sent.get(id, {})
+        data = {}
+        fingerprints = {}
+        for index in sorted(display.updated):
+            widget = display.widgets[index][0]
+            label = display.labels[index]
+            fingerprint = fingerprints[label] = widget.fingerprint()
+            if fingerprint is None or sent.get(label) != fingerprint:
+                data[label] = widget.dump_data()
+
+        return data, fingerprints
+
+    async def render(self, id, display, frames):
+        """ Renders the display in its worker and updates the frames, returns
+        whether a new version was published
+        """
+        shard = self.shards[id]
+        config = self.configs[id]
+        data, fingerprints = self._changed_data(id, display)
+
+        loop = asyncio.get_running_loop()
+        try:
+            frame, timings, lookups = await loop.run_in_executor(
+                self.executors[shard], render_in_worker, id, data
+            )
+        except BrokenProcessPool:
+            # The displays of the worker start over with a new one
+            logger.error(f"Render worker {shard} died, restarting it")
+            self.executors[shard] = self._create_executor(shard)
+            for other, other_shard in self.shards.items():
+                if other_shard == shard:
+                    self.sent.pop(other, None)
+            raise
+
+        # Only once the worker loaded the data, it is sent again otherwise.
+        # A worker configured again meanwhile has no data.
+        if self.configs.get(id) is config:
+            self.sent.setdefault(id, {}).update(fingerprints)
+        display.timings.update(timings)
+        # The texts are measured in the worker, the server exports the metrics
+        for result, count in lookups.items():
+            metrics.text_metrics_lookups_total.inc(count, result=result)
+        if frame is None:
+            return False
+
+        (
+            frames.version,
+            frames.image,
+            frames.data,
+            frames.framebuffers,
+            frames.deltas,
+        ) = frame
+        return True
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,131 @@
+import time
+import heapq
+import random
+import asyncio
+import logging
+from epaperengine import metrics
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of displays fetching their data or rendering at once
+MAX_CONCURRENT_UPDATES = 4
+
+# The first updates are spread over this number of seconds
+STARTUP_JITTER = 10
+
+# Seconds to wait before retrying a failed update, doubled after each
+# consecutive failure
+RETRY_DELAY = 10
+MAX_RETRY_DELAY = 600
+
+
+class Scheduler:
+    """ Runs the updates of all the displays from a single queue ordered by
+    due time, with a limit on the number of concurrent updates.
+
+    Failed updates are retried with an exponential backoff.
+    """
+
+    def __init__(
+        self, max_concurrent=MAX_CONCURRENT_UPDATES, startup_jitter=STARTUP_JITTER
+    ):
+        self.startup_jitter = startup_jitter
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.wakeup = asyncio.Event()
+        self.updaters = {}
+
+        # Heap of (due time, display id), with the current due time of each
+        # display to skip the outdated entries
+        self.queue = []
+        self.due = {}
+        self.running = {}
+        self.refreshes = set()
+        self.failures = {}
+        self.task = None
+
+    def _schedule(self, id, due_at):
+        self.due[id] = due_at
+        heapq.heappush(self.queue, (due_at, id))
+        self.wakeup.set()
+
+    def add(self, id, updater, delay=None):
+        """ Schedules the updates of a display, the first one after the
+        delay in seconds or a random delay
+        """
+        if delay is None:
+            delay = random.uniform(0, self.startup_jitter)
+
+        self.remove(id)
+        self.updaters[id] = updater
+        self._schedule(id, time.monotonic() + delay)
+
+    def remove(self, id):
+        """ Stops the updates of a display, cancelling the running one
+        """
+        self.updaters.pop(id, None)
+        self.due.pop(id, None)
+        self.refreshes.discard(id)
+        self.failures.pop(id, None)
+
+        task = self.running.pop(id, None)
+        if task is not None:
+            task.cancel()
+
+    def refresh(self, id):
+        """ Updates all the widgets of the display as soon as possible
+        """
+        self.updaters[id].expire()
+        if id in self.running:
+            # Run again once the current update ends
+            self.refreshes.add(id)
+        else:
+            self._schedule(id, time.monotonic())
+
+    async def _update(self, id):
+        updater = self.updaters[id]
+        try:
+            async with self.semaphore:
+                next_update = await updater.update()
+            self.failures.pop(id, None)
+        except Exception:
+            failures = self.failures[id] = self.failures.get(id, 0) + 1
+            delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (failures - 1))
+            metrics.display_update_failures_total.inc(display=id)
+            logger.exception(
+                f"Error while updating display {id}, retrying in {delay} seconds"
+            )
+            next_update = time.monotonic() + delay
+        finally:
+            if self.running.get(id) is asyncio.current_task():
+                del self.running[id]
+
+        # The display was removed or replaced during the update
+        if self.updaters.get(id) is not updater:
+            return
+
+        if id in self.refreshes:
+            self.refreshes.discard(id)
+            next_update = time.monotonic()
+        self._schedule(id, next_update)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            # Start the updates which are due
+            now = time.monotonic()
+            while self.queue and self.queue[0][0] <= now:
+                due_at, id = heapq.heappop(self.queue)
+                if self.due.get(id) != due_at or id in self.running:
+                    continue
+
+                self.running[id] = asyncio.create_task(self._update(id))
+
+            # Sleep until the next update or a change of the queue
+            self.wakeup.clear()
+            timeout = self.queue[0][0] - now if self.queue else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,443 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+import requests
+import httplib2
+import googlemaps
+from concurrent.futures import Future
+from dateutil import parser
+from datetime import datetime, date
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp
+from epaperengine.httpclient import HTTP_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# The list of calendars of an account rarely changes
+CALENDARS_TTL = 3600
+
+# Maximum number of requests in a batch of the Calendar API
+BATCH_SIZE = 50
+
+# Seconds during which an expired entry is kept to revalidate it with its
+# ETag or Last-Modified header, it is then evicted
+STALE_TTL = 3600
+
+# Minimum number of seconds between two evictions of the expired entries
+EVICT_INTERVAL = 60
+
+# Sent to fetch a document again after a 304 response without a cached body
+NO_CACHE_HEADERS = {"Cache-Control": "no-cache"}
+
+
+class CacheEntry:
+    def __init__(self, value, validators=None, ttl=0):
+        self.value = value
+        self.validators = validators or {}
+        self.ttl = ttl
+        self.fetched_at = time.monotonic()
+
+    def is_fresh(self, ttl):
+        return time.monotonic() - self.fetched_at < ttl
+
+    def is_stale(self, now):
+        return now - self.fetched_at >= self.ttl + STALE_TTL
+
+
+class DataCache:
+    """ Process-wide cache of the upstream data, indexed by the request
+    parameters.
+
+    Concurrent requests for the same key are coalesced into a single fetch.
+    The entries are evicted once they are expired for STALE_TTL seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.pending = {}
+        self.pending_async = {}
+        self.evicted_at = time.monotonic()
+
+    def _put(self, key, value, validators, ttl):
+        with self.lock:
+            if ttl > 0:
+                self.entries[key] = CacheEntry(value, validators, ttl)
+
+            # Evict the entries which are no longer requested, such as the
+            # events of the previous days
+            now = time.monotonic()
+            if now - self.evicted_at >= EVICT_INTERVAL:
+                self.evicted_at = now
+                for other in list(self.entries):
+                    if self.entries[other].is_stale(now):
+                        del self.entries[other]
+
+    def _fetch(self, key, fetch, entry):
+        if replaying():
+            time.sleep(recorder.latency)
+            return recorder.load(key), None
+
+        value, validators = fetch(entry)
+        if recorder is not None:
+            recorder.save(key, value)
+        return value, validators
+
+    async def _fetch_async(self, key, fetch, entry):
+        if replaying():
+            await asyncio.sleep(recorder.latency)
+            return recorder.load(key), None
+
+        value, validators = await fetch(entry)
+        if recorder is not None:
+            recorder.save(key, value)
+        return value, validators
+
+    def get(self, key, fetch, ttl):
+        """ Returns the value for the key if it was fetched less than ttl
+        seconds ago, or calls fetch(previous_entry) which returns the new
+        value and its validators. With a ttl of 0, the concurrent requests
+        are coalesced but the value is not kept.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.is_fresh(ttl):
+                return entry.value
+
+            # Wait for the request in flight if any
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pending[key] = Future()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            return future.result()
+
+        try:
+            value, validators = self._fetch(key, fetch, entry)
+            self._put(key, value, validators, ttl)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            # The waiting threads always get the outcome
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+    async def get_async(self, key, fetch, ttl):
+        """ Same as get, for a coroutine fetch called from the event loop
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry.is_fresh(ttl):
+            return entry.value
+
+        # Wait for the request in flight if any
+        future = self.pending_async.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self.pending_async[key] = asyncio.get_running_loop().create_future()
+        try:
+            value, validators = await self._fetch_async(key, fetch, entry)
+            self._put(key, value, validators, ttl)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            # Only raised to the waiting requests
+            future.exception()
+            raise
+        finally:
+            del self.pending_async[key]
+
+
+cache = DataCache()
+session = requests.Session()
+maps_clients = {}
+
+# Recorder saving the fetched data, or replaying it instead of fetching it
+recorder = None
+
+
+def replaying():
+    return recorder is not None and recorder.replaying
+
+
+def get_json(url, params, ttl):
+    """ Fetches a JSON document, revalidated with the ETag or Last-Modified
+    headers when the upstream server provides them
+    """
+
+    def fetch(previous):
+        response = session.get(
+            url,
+            params=params,
+            headers=_conditional_headers(previous),
+            timeout=HTTP_TIMEOUT,
+        )
+        if response.status_code == 304:
+            if previous is not None:
+                return previous.value, previous.validators
+
+            # Not modified without a cached body, such as from a proxy
+            response = session.get(
+                url, params=params, headers=NO_CACHE_HEADERS, timeout=HTTP_TIMEOUT
+            )
+            _check_body(url, response.status_code)
+
+        response.raise_for_status()
+        return response.json(), _validators(response.headers)
+
+    key = ("json", url, tuple(sorted(params.items())))
+    return cache.get(key, fetch, ttl)
+
+
+async def get_json_async(http, url, params, ttl):
+    """ Same as get_json, using the shared HTTP client without blocking
+    """
+
+    async def fetch(previous):
+        status, headers, body = await http.get(
+            url, params=params, headers=_conditional_headers(previous)
+        )
+        if status == 304:
+            if previous is not None:
+                return previous.value, previous.validators
+
+            # Not modified without a cached body, such as from a proxy
+            status, headers, body = await http.get(
+                url, params=params, headers=NO_CACHE_HEADERS
+            )
+            _check_body(url, status)
+
+        return json.loads(body), _validators(headers)
+
+    key = ("json", url, tuple(sorted(params.items())))
+    return await cache.get_async(key, fetch, ttl)
+
+
+def _check_body(url, status):
+    if status == 304:
+        raise ValueError(f"{url} returned 304 Not Modified without a cached body")
+
+
+def _conditional_headers(previous):
+    headers = {}
+    if previous is not None:
+        if "ETag" in previous.validators:
+            headers["If-None-Match"] = previous.validators["ETag"]
+        if "Last-Modified" in previous.validators:
+            headers["If-Modified-Since"] = previous.validators["Last-Modified"]
+
+    return headers
+
+
+def _validators(headers):
+    return {
+        name: headers[name] for name in ("ETag", "Last-Modified") if name in headers
+    }
+
+
+def _maps_client(key):
+    with cache.lock:
+        client = maps_clients.get(key)
+        if client is None:
+            client = maps_clients[key] = googlemaps.Client(
+                key=key, timeout=HTTP_TIMEOUT
+            )
+
+    return client
+
+
+def get_directions(key, origin, destination, units, ttl):
+    """ Fetches the current driving directions between two addresses
+    """
+
+    def fetch(previous):
+        directions = _maps_client(key).directions(
+            origin,
+            destination,
+            units=units,
+            mode="driving",
+            departure_time=datetime.now(),
+        )
+        return directions, None
+
+    return cache.get(("directions", key, origin, destination, units), fetch, ttl)
+
+
+def get_static_map(key, params):
+    """ Fetches a static map, returns the raw PNG image. It is not cached,
+    the widgets keep the decoded maps.
+    """
+
+    def fetch(previous):
+        response = _maps_client(key)._request(
+            url="/maps/api/staticmap", params=params, extract_body=lambda r: r
+        )
+        response.raise_for_status()
+
+        if "X-Staticmap-API-Warning" in response.headers:
+            logger.warn(response.headers["X-Staticmap-API-Warning"])
+
+        return response.content, None
+
+    return cache.get(("staticmap", key, tuple(sorted(params.items()))), fetch, 0)
+
+
+class CalendarSync:
+    """ Keeps the events of the calendars of an account over a time window,
+    updated incrementally with the sync tokens of the Calendar API.
+
+    All the calendars are requested in a single batch.
+    """
+
+    def __init__(self, creds):
+        self.creds = creds
+        self.lock = threading.Lock()
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        self.service = build("calendar", "v3", http=http, cache_discovery=False)
+
+        self.window = None
+        self.tokens = {}
+        self.events = {}
+
+    def _request(self, calendar_id):
+        token = self.tokens.get(calendar_id)
+        if token is not None:
+            return self.service.events().list(
+                calendarId=calendar_id, singleEvents=True, syncToken=token
+            )
+
+        # The events are sorted by the widget, orderBy prevents sync tokens
+        time_min, time_max = self.window
+        return self.service.events().list(
+            calendarId=calendar_id,
+            singleEvents=True,
+            timeMin=time_min.isoformat(),
+            timeMax=time_max.isoformat(),
+        )
+
+    def _apply(self, calendar_id, request, response):
+        if self.tokens.get(calendar_id) is None:
+            self.events[calendar_id] = {}
+        events = self.events[calendar_id]
+
+        while True:
+            for event in response["items"]:
+                if event.get("status") == "cancelled":
+                    events.pop(event["id"], None)
+                else:
+                    events[event["id"]] = event
+
+            # Rare, a day of events fits in a page
+            request = self.service.events().list_next(request, response)
+            if request is None:
+                break
+            response = request.execute()
+
+        self.tokens[calendar_id] = response.get("nextSyncToken")
+
+    def fetch(self, calendar_ids, time_min, time_max):
+        with self.lock:
+            # Start over with a full sync when the window changes
+            if self.window != (time_min, time_max):
+                self.window = (time_min, time_max)
+                self.tokens = {}
+                self.events = {}
+
+            list_requests = {
+                calendar_id: self._request(calendar_id) for calendar_id in calendar_ids
+            }
+            responses = {}
+
+            def callback(request_id, response, exception):
+                responses[calendar_ids[int(request_id)]] = (response, exception)
+
+            # The API rejects the batches of more than BATCH_SIZE requests
+            for start in range(0, len(calendar_ids), BATCH_SIZE):
+                batch = self.service.new_batch_http_request(callback=callback)
+                for index in range(start, min(start + BATCH_SIZE, len(calendar_ids))):
+                    batch.add(list_requests[calendar_ids[index]], request_id=str(index))
+                batch.execute()
+
+            for calendar_id in calendar_ids:
+                response, exception = responses[calendar_id]
+
+                # The sync token expired, run a full sync for this calendar
+                if isinstance(exception, HttpError) and exception.resp.status == 410:
+                    del self.tokens[calendar_id]
+                    list_requests[calendar_id] = self._request(calendar_id)
+                    response, exception = list_requests[calendar_id].execute(), None
+
+                if exception is not None:
+                    raise exception
+
+                self._apply(calendar_id, list_requests[calendar_id], response)
+
+            return [
+                event
+                for calendar_id in calendar_ids
+                for event in self.events[calendar_id].values()
+                if _overlaps(event, time_min, time_max)
+            ]
+
+
+def _event_time(value, tzinfo):
+    if "dateTime" in value:
+        return parser.parse(value["dateTime"])
+    day = date.fromisoformat(value["date"])
+    start = datetime.combine(day, datetime.min.time())
+
+    # The offset of a pytz timezone depends on the date
+    if hasattr(tzinfo, "localize"):
+        return tzinfo.localize(start)
+    return start.replace(tzinfo=tzinfo)
+
+
+def _overlaps(event, time_min, time_max):
+    # The updates received incrementally are not limited to the window
+    start = _event_time(event["start"], time_min.tzinfo)
+    end = _event_time(event["end"], time_min.tzinfo)
+    return start <= time_max and end > time_min
+
+
+calendar_syncs = {}
+calendar_syncs_lock = threading.Lock()
+
+
+def _calendar_sync(creds, account):
+    # The service is kept as long as the credentials do not change. Building
+    # it parses the discovery document, the data cache is not locked meanwhile
+    with calendar_syncs_lock:
+        sync = calendar_syncs.get(account)
+        if sync is None or sync.creds is not creds:
+            sync = calendar_syncs[account] = CalendarSync(creds)
+
+    return sync
+
+
+def get_calendar_events(creds, account, time_min, time_max, ttl):
+    """ Fetches the events of all the calendars of an account between two
+    dates, the account identifies the credentials in the cache
+    """
+
+    def fetch_calendars(previous):
+        service = _calendar_sync(creds, account).service
+        calendars = service.calendarList().list().execute()
+        return [calendar["id"] for calendar in calendars["items"]], None
+
+    def fetch(previous):
+        calendar_ids = cache.get(("calendars", account), fetch_calendars, CALENDARS_TTL)
+        sync = _calendar_sync(creds, account)
+        return sync.fetch(calendar_ids, time_min, time_max), None
+
+    key = ("calendar", account, time_min.isoformat(), time_max.isoformat())
+    return cache.get(key, fetch, ttl)
@@ -0,0 +1,76 @@
+import io
+import os
+import json
+import logging
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class DisplayStorage:
+    """ Saves the last frame and the data of the widgets of a display, so
+    that it can be served right after a restart
+    """
+
+    def __init__(self, directory, id):
+        self.path = os.path.join(directory, id)
+        os.makedirs(self.path, exist_ok=True)
+
+        # Fingerprints of the widgets when their data was last saved
+        self.saved = None
+
+    def _write(self, name, content):
+        # Replace the file at once so that a crash never leaves it truncated
+        path = os.path.join(self.path, name)
+        with open(path + ".tmp", "wb") as output:
+            output.write(content)
+        os.replace(path + ".tmp", path)
+
+    def save_frame(self, image):
+        output = io.BytesIO()
+        image.save(output, format="PNG")
+        self._write("frame.png", output.getvalue())
+
+    def _fingerprints(self, display):
+        fingerprints = tuple(
+            (index, display.widgets[index][0].fingerprint())
+            for index in sorted(display.updated)
+        )
+        # A widget without fingerprint may always have new data
+        if any(fingerprint is None for _, fingerprint in fingerprints):
+            return None
+        return fingerprints
+
+    def save_widgets(self, display):
+        """ Saves the data of the widgets, unless it did not change since the
+        last save
+        """
+        fingerprints = self._fingerprints(display)
+        if fingerprints is not None and fingerprints == self.saved:
+            return
+
+        self._write("widgets.json", json.dumps(display.dump_widgets()).encode("utf-8"))
+        self.saved = fingerprints
+
+    def restore(self, display):
+        """ Loads the saved data into the widgets of the display, returns
+        the saved frame or None
+        """
+        try:
+            with open(os.path.join(self.path, "widgets.json")) as widgets_file:
+                display.load_widgets(json.load(widgets_file))
+            self.saved = self._fingerprints(display)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.exception(f"Could not restore the widgets from {self.path}")
+
+        try:
+            image = Image.open(os.path.join(self.path, "frame.png"))
+            image.load()
+            return image
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.exception(f"Could not restore the frame from {self.path}")
+            return None
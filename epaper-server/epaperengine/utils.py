@@ -1,5 +1,14 @@
+import json
 import random
 import string
+import hashlib
+from datetime import datetime, time, timedelta, timezone
+
+DURATION_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# Aware datetime returned by now() instead of the current time, to render
+# the displays at another time
+simulated_now = None
 
 
 def parse_dimensions(dimensions):
@@ -12,7 +21,59 @@ def parse_position(position):
     return list(map(int, position.split(", ")))
 
 
+def parse_duration(duration):
+    """Parse a positive number of seconds or a duration such as "10 minutes" """
+    if isinstance(duration, (int, float)):
+        seconds = duration
+    else:
+        try:
+            value, unit = duration.split()
+            seconds = float(value) * DURATION_UNITS[unit.rstrip("s")]
+        except (ValueError, KeyError):
+            raise ValueError(
+                f'Invalid duration "{duration}", expected a number of seconds or '
+                f'a number followed by {", ".join(DURATION_UNITS)}'
+            ) from None
+
+    # A display updated continuously would flood the upstream APIs
+    if seconds <= 0:
+        raise ValueError(f'Invalid duration "{duration}", it must be positive')
+    return timedelta(seconds=seconds)
+
+
+def now(tz):
+    """Return the current time, or the simulated one, in the timezone """
+    if simulated_now is None:
+        return datetime.now(tz)
+    return simulated_now.astimezone(tz)
+
+
+def parse_time(value):
+    """Parse an ISO 8601 time, in the local timezone if it has no offset """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.astimezone()
+    return parsed
+
+
+def next_midnight(tz):
+    """Return the start of the next day in a pytz timezone """
+    tomorrow = now(tz).date() + timedelta(days=1)
+    return tz.localize(datetime.combine(tomorrow, time()))
+
+
+def expires_in(seconds):
+    """Return the aware datetime in the given number of seconds """
+    return now(timezone.utc) + timedelta(seconds=seconds)
+
+
 def random_string(length):
     """Generate a random string of fixed length """
     letters = string.ascii_lowercase + string.digits
     return "".join(random.choice(letters) for i in range(length))
+
+
+def hash_data(*data):
+    """Generate a stable hash of JSON-serializable data """
+    content = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
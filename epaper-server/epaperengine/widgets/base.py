@@ -1,4 +1,8 @@
 class BaseWidget:
+    # Fonts (name, size) indexed by usage and icons preloaded for the widget
+    fonts = {}
+    icons = ()
+
     def __init__(self, settings, size):
         """ Prepare everything you need here and copy the relevant
         parts of the configuration
@@ -6,11 +10,52 @@ class BaseWidget:
         pass
 
     def update(self):
-        """ Updates the data
+        """ Updates the data.
+
+        An update which timed out may still be running while the widget is
+        drawn: the data used by draw is replaced at once, with a single
+        assignment, and the fingerprint is set after it so that a tile is
+        never saved with the fingerprint of newer data.
+        """
+        pass
+
+    async def update_async(self, http):
+        """ Updates the data without blocking, using the shared HttpClient.
+        Widgets implementing it are updated on the event loop instead of
+        calling update in a thread.
+        """
+        pass
+
+    def dump_data(self):
+        """ Returns the data fetched by update as a JSON-serializable value
+        """
+        return None
+
+    def load_data(self, data):
+        """ Restores the data returned by dump_data instead of fetching it
         """
         pass
 
+    def next_change(self):
+        """ Returns the earliest aware datetime at which the drawing can
+        change, even without new data. None if it only changes with the data.
+        """
+        return None
+
+    def data_expires_at(self):
+        """ Returns the aware datetime until which the fetched data cannot
+        change, even if the widget is updated before. None if unknown.
+        """
+        return None
+
+    def fingerprint(self):
+        """ Returns a cheap value identifying the data used by draw, the
+        widget is only redrawn when it changes. None always redraws.
+        """
+        return None
+
     def draw(self, helper):
-        """ Draws the widget on the image using the data provided
+        """ Draws the widget on the image using the data provided, read once
+        since an update may replace it meanwhile
         """
         pass
@@ -1,7 +1,7 @@
 import locale
 from pytz import timezone
 from babel.dates import format_date
-from datetime import datetime
+from epaperengine.utils import next_midnight, now
 from epaperengine.widgets.base import BaseWidget
 
 
@@ -10,6 +10,13 @@ class DateWidget(BaseWidget):
         self.timezone = timezone(settings["timezone"])
         self.locale = settings["locale"]
         self.size = size
+        self.fonts = {"date": ("OpenSans-Bold-webfont.woff", size[1] - 41)}
+
+    def next_change(self):
+        return next_midnight(self.timezone)
+
+    def fingerprint(self):
+        return now(self.timezone).date()
 
     def draw(self, helper):
         # Add background
@@ -18,16 +25,14 @@ class DateWidget(BaseWidget):
         )
 
         # Add left clock
-        now = datetime.now(self.timezone)
+        today = now(self.timezone)
 
         # Add right date
-        text = format_date(now, format="full", locale=self.locale)
-        w, h = helper.draw.textsize(
-            text, helper.font(("OpenSans-Bold-webfont.woff", self.size[1] - 41))
-        )
+        text = format_date(today, format="full", locale=self.locale)
+        w, h = helper.textsize(text, self.fonts["date"])
         helper.text(
             (self.size[0] - 20 - w, round((self.size[1] - h) / 2)),
             text,
-            font=("OpenSans-Bold-webfont.woff", self.size[1] - 41),
+            font=self.fonts["date"],
             fill=helper.WHITE,
         )
@@ -6,15 +6,17 @@ import pickle
 from operator import attrgetter
 import json
 from babel.dates import format_date, format_time
-import requests
 from datetime import datetime, date, time
-from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
+from epaperengine import utils
+from epaperengine.utils import expires_in, hash_data, next_midnight
+from epaperengine import sources
 from epaperengine.widgets.base import BaseWidget
 from google.auth.transport.requests import Request
 
 EVENT_LINE_HEIGHT = 35
 LEFT_MARGIN = 15
+EVENTS_TTL = 300
 
 
 class GoogleEvent:
@@ -34,6 +36,12 @@ class GoogleEvent:
 
 class GooglecalendarWidget(BaseWidget):
     SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
+    fonts = {
+        "date": ("OpenSans-Bold-webfont.woff", 40),
+        "day": ("OpenSans-Regular-webfont.woff", 25),
+        "time": ("OpenSans-Bold.ttf", 18),
+        "title": ("OpenSans-Regular-webfont.woff", 18),
+    }
 
     def __init__(self, settings, size):
         self.timezone = timezone(settings["timezone"])
@@ -45,13 +53,29 @@ class GooglecalendarWidget(BaseWidget):
         # Load creds
         # See https://developers.google.com/calendar/quickstart/python
         self.creds = None
+        self.saved_creds = None
+        self.agenda = None
+        self.data_hash = None
+        self.expires_at = None
         if os.path.exists(self.token_store):
             with open(self.token_store, "rb") as token:
-                self.creds = pickle.load(token)
+                self.saved_creds = token.read()
+                self.creds = pickle.loads(self.saved_creds)
+
+    def _save_credentials(self):
+        # Only write the credentials when they were refreshed
+        content = pickle.dumps(self.creds)
+        if content == self.saved_creds:
+            return
+
+        with open(self.token_store, "wb") as token:
+            token.write(content)
+        self.saved_creds = content
 
     def update(self):
-        # Authenticate if necessary
-        if not self.creds or not self.creds.valid:
+        # Authenticate if necessary, the replayed events need no credentials
+        replaying = sources.replaying()
+        if not replaying and (not self.creds or not self.creds.valid):
             if self.creds and self.creds.expired and self.creds.refresh_token:
                 self.creds.refresh(Request())
             else:
@@ -59,41 +83,29 @@ class GooglecalendarWidget(BaseWidget):
                     self.credentials, self.SCOPES
                 )
                 self.creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open(self.token_store, "wb") as token:
-            pickle.dump(self.creds, token)
+            # Save the credentials for the next run
+            self._save_credentials()
 
-        # Fetch list of calendars
-        service = build("calendar", "v3", credentials=self.creds)
-
-        today = datetime.now(self.timezone).replace(
+        today = utils.now(self.timezone).replace(
             hour=0, minute=0, second=0, microsecond=0
         )
-        tomorrow = datetime.now(self.timezone).replace(
+        tomorrow = utils.now(self.timezone).replace(
             hour=23, minute=59, second=59, microsecond=0
         )
 
-        calendars = service.calendarList().list().execute()
-
-        calendar_ids = [calendar["id"] for calendar in calendars["items"]]
-
-        # Fetch events
-        all_events = []
-        for calendar_id in calendar_ids:
-            events = (
-                service.events()
-                .list(
-                    calendarId=calendar_id,
-                    orderBy="startTime",
-                    singleEvents=True,
-                    timeMin=today.isoformat(),
-                    timeMax=tomorrow.isoformat(),
-                )
-                .execute()
-            )
+        # Fetch events of all calendars
+        items = sources.get_calendar_events(
+            self.creds, self.token_store, today, tomorrow, EVENTS_TTL
+        )
 
-            for event in events["items"]:
-                all_events.append(GoogleEvent(event))
+        # The credentials may have been refreshed while fetching
+        if not replaying:
+            self._save_credentials()
+        self._set_events(items)
+        self.expires_at = expires_in(EVENTS_TTL)
+
+    def _set_events(self, items):
+        all_events = [GoogleEvent(event) for event in items]
 
         # Sort events
         all_events.sort(key=attrgetter("created_at"))
@@ -108,7 +120,30 @@ class GooglecalendarWidget(BaseWidget):
         day_events.sort(key=attrgetter("start"))
         hour_events.sort(key=attrgetter("start"))
 
-        self.events = day_events + hour_events
+        # The events are drawn from their layout, they are replaced together
+        self.agenda = (items, day_events + hour_events)
+        self.data_hash = hash_data(items)
+
+    def dump_data(self):
+        if self.agenda is None:
+            return None
+
+        items, _ = self.agenda
+        return {"events": items}
+
+    def load_data(self, data):
+        self._set_events(data["events"])
+
+    def next_change(self):
+        # The whole day is shown, it changes with the day
+        return next_midnight(self.timezone)
+
+    def data_expires_at(self):
+        # The events are fetched again once the cached ones expire
+        return self.expires_at
+
+    def fingerprint(self):
+        return (utils.now(self.timezone).date(), self.data_hash)
 
     def draw(self, helper):
         # Add background
@@ -117,12 +152,12 @@ class GooglecalendarWidget(BaseWidget):
         )
 
         # Add date
-        now = datetime.now(self.timezone)
+        now = utils.now(self.timezone)
         text = format_date(now, format="medium", locale=self.locale)
         helper.text(
             (LEFT_MARGIN, 32),
             text,
-            font=("OpenSans-Bold-webfont.woff", 40),
+            font=self.fonts["date"],
             fill=helper.COLOR,
         )
 
@@ -130,13 +165,14 @@ class GooglecalendarWidget(BaseWidget):
         helper.text(
             (LEFT_MARGIN, 10),
             text,
-            font=("OpenSans-Regular-webfont.woff", 25),
+            font=self.fonts["day"],
             fill=helper.COLOR,
         )
 
         # Add day events
+        _, events = self.agenda
         event_count = 0
-        for event in self.events:
+        for event in events:
             top = 110 + event_count * EVENT_LINE_HEIGHT
 
             if isinstance(event.start, datetime):
@@ -152,14 +188,14 @@ class GooglecalendarWidget(BaseWidget):
             helper.text(
                 (LEFT_MARGIN, top - 1),
                 time_label,
-                font=("OpenSans-Bold.ttf", 18),
+                font=self.fonts["time"],
                 fill=helper.WHITE,
             )
 
             helper.text(
                 (LEFT_MARGIN + 60, top),
                 event.title,
-                font=("OpenSans-Regular-webfont.woff", 18),
+                font=self.fonts["title"],
                 fill=helper.WHITE,
             )
             helper.draw.line(
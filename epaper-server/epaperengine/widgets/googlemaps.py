@@ -1,15 +1,84 @@
 import io
+import os
 import math
+import base64
+import hashlib
 import logging
-import googlemaps
+from collections import OrderedDict
 from babel.dates import format_timedelta
-from datetime import datetime, timedelta
+from datetime import timedelta
 from PIL import Image
+from epaperengine.utils import expires_in, hash_data
+from epaperengine import sources
+from epaperengine.helper import to_indexes
 from epaperengine.widgets.base import BaseWidget
 
 logger = logging.getLogger(__name__)
 
 HEADER_SIZE = 70
+DIRECTIONS_TTL = 120
+MAP_CACHE_SIZE = 32
+
+
+class MapCache:
+    """ Keeps the most recently used maps, decoded and converted to the
+    colors of the display, indexed by route. The maps are also saved into
+    the directory if provided, which keeps as many maps.
+    """
+
+    def __init__(self, max_size, directory=None):
+        self.maps = OrderedDict()
+        self.max_size = max_size
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{name}.png")
+
+    def _add(self, key, image):
+        self.maps[key] = image
+        if len(self.maps) > self.max_size:
+            self.maps.popitem(last=False)
+
+    def get(self, key):
+        image = self.maps.get(key)
+        if image is not None:
+            self.maps.move_to_end(key)
+            self.hits += 1
+            return image
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            image = to_indexes(Image.open(self._path(key)))
+            # Keep it in the directory as recently used
+            os.utime(self._path(key))
+            self._add(key, image)
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        return None
+
+    def _prune(self):
+        # Remove the least recently used maps from the directory
+        paths = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".png")
+        ]
+        paths.sort(key=os.path.getmtime)
+        for path in paths[: max(0, len(paths) - self.max_size)]:
+            os.remove(path)
+
+    def put(self, key, image):
+        self._add(key, image)
+        if self.directory is not None:
+            image.save(self._path(key), format="PNG")
+            self._prune()
 
 
 class GooglemapsWidget(BaseWidget):
@@ -27,18 +96,25 @@ class GooglemapsWidget(BaseWidget):
         self.size = size
 
         # State
-        self.client = googlemaps.Client(key=self.key)
-        self.map_cache = {}
-        self.map = None
-        self.directions = None
+        self.map_cache = MapCache(
+            settings.get("map_cache_size", MAP_CACHE_SIZE),
+            settings.get("map_cache_dir"),
+        )
+        self.route = None
+        self.data_hash = None
+        self.expires_at = None
 
     def _fetch_map(self, directions):
         path = directions[0]["overview_polyline"]["points"]
 
-        if path in self.map_cache:
-            return self.map_cache[path]
+        map = self.map_cache.get(path)
+        if map is not None:
+            return map
 
-        logger.info("Fetching map not in cache")
+        logger.info(
+            f"Fetching map not in cache ({self.map_cache.hits} hits, "
+            f"{self.map_cache.misses} misses)"
+        )
 
         width = self.size[0]
         height = self.size[1] - HEADER_SIZE
@@ -52,39 +128,62 @@ class GooglemapsWidget(BaseWidget):
             "style": "visibility:simplified",
         }
 
-        response = self.client._request(
-            url="/maps/api/staticmap", params=arguments, extract_body=lambda r: r
-        )
-        response.raise_for_status()
-
-        if "X-Staticmap-API-Warning" in response.headers:
-            logger.warn(response.headers["X-Staticmap-API-Warning"])
-
-        # Save to cache and return
-        self.map_cache[path] = response.content
+        # Decode, save to cache and return
+        content = sources.get_static_map(self.key, arguments)
+        map = to_indexes(Image.open(io.BytesIO(content)))
+        self.map_cache.put(path, map)
 
-        return self.map_cache[path]
+        return map
 
     def update(self):
-        now = datetime.now()
-
         # Fetch directions
-        directions = self.client.directions(
-            self.home, self.work, units=self.units, mode="driving", departure_time=now
+        directions = sources.get_directions(
+            self.key, self.home, self.work, self.units, DIRECTIONS_TTL
         )
 
         # Load map
         map = self._fetch_map(directions)
 
         # Save if everything went right
-        self.map = map
-        self.directions = directions
+        self._set_route(directions, map)
+        self.expires_at = expires_in(DIRECTIONS_TTL)
+
+    def _set_route(self, directions, map):
+        # The map shows the route of the directions, both are replaced together
+        self.route = (directions, map)
+        self.data_hash = hash_data(directions)
+
+    def dump_data(self):
+        # No map was fetched yet
+        if self.route is None:
+            return None
+
+        directions, map = self.route
+        output = io.BytesIO()
+        map.save(output, format="PNG")
+
+        return {
+            "directions": directions,
+            "map": base64.b64encode(output.getvalue()).decode("ascii"),
+        }
+
+    def load_data(self, data):
+        map = to_indexes(Image.open(io.BytesIO(base64.b64decode(data["map"]))))
+        self._set_route(data["directions"], map)
+
+    def data_expires_at(self):
+        # The traffic is fetched again once the cached directions expire
+        return self.expires_at
+
+    def fingerprint(self):
+        return self.data_hash
 
     def draw(self, helper):
+        directions, map = self.route
         time = timedelta(
-            seconds=self.directions[0]["legs"][0]["duration_in_traffic"]["value"]
+            seconds=directions[0]["legs"][0]["duration_in_traffic"]["value"]
         )
-        route = self.directions[0]["summary"]
+        route = directions[0]["summary"]
 
         # Display the time
         helper.text(
@@ -103,4 +202,4 @@ class GooglemapsWidget(BaseWidget):
         )
 
         # Display the image
-        helper.img.paste(Image.open(io.BytesIO(self.map)).convert("RGB"), (0, 0))
+        helper.img.paste(map, (0, 0))
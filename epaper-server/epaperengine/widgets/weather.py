@@ -1,10 +1,12 @@
 import math
-import requests
 import json
+import asyncio
 import pytz
 from dateutil.parser import parse
 from datetime import datetime, timedelta
 from babel.dates import format_time, get_timezone
+from epaperengine.utils import expires_in, hash_data
+from epaperengine import sources
 from epaperengine.widgets.base import BaseWidget
 
 
@@ -30,6 +32,9 @@ WEATHER_CODES_TO_IMAGES = {
 }
 
 BASE_URL = "https://api.openweathermap.org/data/2.5/"
+# OpenWeather updates its data every 10 minutes, fetching it twice as often
+# shows an update at most 5 minutes late
+DATA_TTL = 300
 MIN_WIDTH = 80
 HEADER_HEIGHT = 70
 NEXT_HEIGHT = 85
@@ -43,6 +48,11 @@ class WeatherWidget(BaseWidget):
         "next": ("OpenSans-Regular-webfont.woff", 18),
         "next_bold": ("OpenSans-Bold-webfont.woff", 18),
     }
+    icons = [
+        f"{directory}/{name}.png"
+        for directory in ("weather", "weather_small")
+        for name in set(WEATHER_CODES_TO_IMAGES.values())
+    ]
 
     def __init__(self, settings, size):
         # Config
@@ -53,6 +63,9 @@ class WeatherWidget(BaseWidget):
         self.timezone = get_timezone(settings["timezone"])
         self.size = size
         self.temperature_format = "{:.0f}°F" if self.units == "imperial" else "{:.0f}°C"
+        self.data = None
+        self.data_hash = None
+        self.expires_at = None
 
     def _format_wind(self, speed):
         if self.units == "imperial":
@@ -60,31 +73,51 @@ class WeatherWidget(BaseWidget):
         else:
             return "{:.0f} km/h".format(speed * 3.6)
 
-    def update(self):
-        # Fetch now
-        response = requests.get(
-            "{}/weather?id={}&units={}&lang={}&APPID={}".format(
-                BASE_URL, self.city_id, self.units, self.lang, self.api_key
-            )
+    async def update_async(self, http):
+        params = {
+            "id": self.city_id,
+            "units": self.units,
+            "lang": self.lang,
+            "APPID": self.api_key,
+        }
+
+        # Fetch now and forecast, shared with the displays showing the same city
+        now, forecast = await asyncio.gather(
+            sources.get_json_async(http, BASE_URL + "weather", params, DATA_TTL),
+            sources.get_json_async(http, BASE_URL + "forecast", params, DATA_TTL),
         )
-        response.raise_for_status()
-        self.now = response.json()
+        self._set_data({"now": now, "forecast": forecast})
+        self.expires_at = expires_in(DATA_TTL)
 
-        # Fetch forecast
-        response = requests.get(
-            "{}/forecast?id={}&units={}&lang={}&APPID={}".format(
-                BASE_URL, self.city_id, self.units, self.lang, self.api_key
-            )
-        )
-        response.raise_for_status()
-        self.forecast = response.json()
+    def _set_data(self, data):
+        # The current weather and the forecast are fetched separately, they
+        # are replaced together
+        self.data = data
+        self.data_hash = hash_data(data["now"], data["forecast"])
+
+    def dump_data(self):
+        return self.data
+
+    def load_data(self, data):
+        self._set_data(data)
+
+    def data_expires_at(self):
+        # New data is fetched once the cached data expires
+        return self.expires_at
+
+    def fingerprint(self):
+        return self.data_hash
 
     def draw(self, helper):
+        data = self.data
+        now = data["now"]
+        forecast = data["forecast"]
+
         # Display
-        weather = self.now["weather"][0]
+        weather = now["weather"][0]
         w, _ = helper.text(
             (95, 6),
-            self.temperature_format.format(self.now["main"]["temp"]),
+            self.temperature_format.format(now["main"]["temp"]),
             font=self.fonts["main_temp"],
             fill=helper.BLACK,
         )
@@ -96,16 +129,15 @@ class WeatherWidget(BaseWidget):
         )
         helper.text(
             (110 + w, 20),
-            self._format_wind(self.now["wind"]["speed"]),
+            self._format_wind(now["wind"]["speed"]),
             font=self.fonts["details"],
             fill=helper.BLACK,
         )
 
         # Add icon
-        icon = helper.image(
-            "weather/{}.png".format(WEATHER_CODES_TO_IMAGES[weather["icon"]])
+        helper.paste_image(
+            "weather/{}.png".format(WEATHER_CODES_TO_IMAGES[weather["icon"]]), (0, 5)
         )
-        helper.img.paste(icon, (0, 5))
 
         # Display the weather for the rest of the day
         items_count = math.floor(self.size[0] / MIN_WIDTH)
@@ -115,7 +147,7 @@ class WeatherWidget(BaseWidget):
             w = self.size[0] / items_count
             h = NEXT_HEIGHT
 
-            weather_data = self.forecast["list"][i]
+            weather_data = forecast["list"][i]
             weather = weather_data["weather"][0]
 
             # Date
@@ -1,29 +1,62 @@
-import io
+import os
 import time
 import json
+import signal
 import logging
 import asyncio
 import argparse
 import click
 from aiohttp import web
 from epaperengine.display import Display
-from epaperengine.asynchronous import display_updater
+from epaperengine.asynchronous import monitor_event_loop
+from epaperengine.httpclient import HttpClient
+from epaperengine.fleet import Fleet
+from epaperengine.recorder import RECORD, REPLAY, Recorder
+from epaperengine.scheduler import MAX_CONCURRENT_UPDATES
+from epaperengine import (
+    batch as batch_render,
+    bench as benchmark,
+    helper,
+    metrics,
+    sources,
+    utils,
+)
 
 
 MINIMUM_WAITING_TIME = 10
 
+# Seconds between two checks of the modification of the config
+WATCH_INTERVAL = 2
+
+# Formats of the image, with their content type and their key in the status
+FORMATS = {
+    "png": ("image/png", "data"),
+    "epd": ("application/x-epd", "framebuffer"),
+    "epd-rle": ("application/x-epd-rle", "framebuffer_rle"),
+}
+
 
 class Context:
     def __init__(self):
         self.displays = {}
         self.tokens = {}
+        self.scheduler = None
 
     def set_tokens(self, tokens):
         self.tokens = tokens
 
+    def set_scheduler(self, scheduler):
+        self.scheduler = scheduler
+
     def add_display(self, id, display):
         self.displays[id] = display
 
+    def remove_display(self, id):
+        return self.displays.pop(id)
+
+    def get_display_id(self, token):
+        return self.tokens.get(token)
+
     def get_status(self, token):
         display_id = self.tokens.get(token)
         if token is None:
@@ -39,8 +72,7 @@ class Context:
 routes = web.RouteTableDef()
 
 
-@routes.get("/get/")
-async def serve_image(request):
+def get_status_and_headers(request):
     status = request.app["context"].get_status(request.headers.get("X-Display-ID"))
     if status is None:
         raise web.HTTPNotFound()
@@ -48,16 +80,110 @@ async def serve_image(request):
     max_age = max(MINIMUM_WAITING_TIME, round(status["next_update"] - time.monotonic()))
     headers = {"ETag": status["version"], "Cache-Control": f"max-age={max_age}"}
 
+    return status, headers
+
+
+def count_response(request, route, response):
+    display_id = request.app["context"].get_display_id(
+        request.headers.get("X-Display-ID")
+    )
+    metrics.responses_total.inc(display=display_id, route=route, status=response.status)
+    return response
+
+
+def negotiate_format(request):
+    """ Returns the format requested using the format query parameter or
+    the Accept header, PNG by default
+    """
+    name = request.query.get("format")
+    if name is not None:
+        if name not in FORMATS:
+            raise web.HTTPNotAcceptable()
+        return FORMATS[name]
+
+    accepted = [
+        value.split(";")[0].strip()
+        for value in request.headers.get("Accept", "").split(",")
+    ]
+    for content_type, key in FORMATS.values():
+        if content_type in accepted:
+            return content_type, key
+
+    return FORMATS["png"]
+
+
+@routes.get("/get/")
+async def serve_image(request):
+    status, headers = get_status_and_headers(request)
+    content_type, key = negotiate_format(request)
+    headers["Vary"] = "Accept"
+
+    # Return 304 if content did not change
+    client_etag = request.headers.get("ETag")
+    if client_etag == status["version"]:
+        response = web.Response(headers=headers, status=304)
+        return count_response(request, "get", response)
+
+    # Return the image, encoded by the updater when the version changed
+    response = web.Response(
+        body=status[key], content_type=content_type, headers=headers
+    )
+    return count_response(request, "get", response)
+
+
+@routes.get("/delta/")
+async def serve_delta(request):
+    """ Returns the region which changed since the version sent by the
+    client, its position is given by the X-Region header (left, top, right,
+    bottom). The full image is returned if the version is too old.
+    """
+    status, headers = get_status_and_headers(request)
+
     # Return 304 if content did not change
     client_etag = request.headers.get("ETag")
     if client_etag == status["version"]:
-        return web.Response(headers=headers, status=304)
+        response = web.Response(headers=headers, status=304)
+        return count_response(request, "delta", response)
+
+    delta = status["deltas"].get(client_etag)
+    if delta is None:
+        image = status["image"]
+        delta = ((0, 0, image.width, image.height), status["data"])
+
+    box, data = delta
+    headers["X-Region"] = ",".join(map(str, box))
+    response = web.Response(body=data, content_type="image/png", headers=headers)
+    return count_response(request, "delta", response)
+
+
+@routes.post("/refresh/")
+async def refresh_display(request):
+    """ Updates all the widgets of the display as soon as possible
+    """
+    context = request.app["context"]
+    display_id = context.get_display_id(request.headers.get("X-Display-ID"))
+    if display_id not in context.displays:
+        raise web.HTTPNotFound()
+
+    context.scheduler.refresh(display_id)
+    return web.Response(status=202)
+
 
-    # Return the image
-    output = io.BytesIO()
-    status["image"].save(output, format="PNG", bits=2, compress_level=9)
-    output.seek(0, 0)
-    return web.Response(body=output, content_type="image/png", headers=headers)
+@routes.get("/metrics")
+async def serve_metrics(request):
+    """ Returns the metrics of the server in the Prometheus text format
+    """
+    now = time.monotonic()
+    for id, display in request.app["context"].displays.items():
+        if display.updated_at is not None:
+            metrics.last_update_age_seconds.set(now - display.updated_at, display=id)
+    for kind, size in helper.memory_usage().items():
+        metrics.resources_bytes.set(size, kind=kind)
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+    return web.Response(
+        body=metrics.render().encode("utf-8"), headers={"Content-Type": content_type}
+    )
 
 
 async def launch_web_server(context, bind, port):
@@ -75,20 +201,83 @@ async def launch_web_server(context, bind, port):
     return runner
 
 
-async def initialize_displays(context, config_path):
-    # Load configuration
+def load_config(config_path):
     with open(config_path) as config_file:
-        config = json.load(config_file)
+        return json.load(config_file)
 
-    context.set_tokens(config["tokens"])
 
-    for id, display_config in config["displays"].items():
-        # Add display to the context
-        display = Display(display_config)
-        context.add_display(id, display)
+async def initialize_displays(context, config_path, fleet):
+    context.set_scheduler(fleet.scheduler)
+    await fleet.load(load_config(config_path))
+    fleet.start()
 
-        # Start the background task to update
-        asyncio.create_task(display_updater(id, display))
+    usage = helper.memory_usage()
+    logging.info(
+        f"Preloaded {len(helper.fonts.cache)} fonts ({usage['fonts']} bytes) and "
+        f"{len(helper.images.cache)} icons ({usage['icons']} bytes)"
+    )
+
+
+async def reload_config(config_path, fleet):
+    """ Applies the changes of the configuration, keeping the current one
+    if the new one is invalid
+    """
+    try:
+        started, removed = await fleet.load(load_config(config_path))
+        logging.info(
+            f"Configuration reloaded, {len(started)} display(s) started, "
+            f"{len(removed)} removed"
+        )
+    except Exception:
+        logging.exception("Could not reload the configuration")
+
+
+async def watch_config(config_path, fleet):
+    """ Reloads the configuration when the file is modified
+    """
+    modified_at = os.stat(config_path).st_mtime
+    while True:
+        await asyncio.sleep(WATCH_INTERVAL)
+        try:
+            mtime = os.stat(config_path).st_mtime
+        except FileNotFoundError:
+            continue
+
+        if mtime != modified_at:
+            modified_at = mtime
+            await reload_config(config_path, fleet)
+
+
+def recorder_options(command):
+    """ Adds the options to record the upstream data or to replay it
+    """
+    options = [
+        click.option(
+            "--record-http", help="Save the upstream data into this directory"
+        ),
+        click.option(
+            "--replay-http", help="Read the upstream data from this directory"
+        ),
+        click.option(
+            "--http-latency",
+            default=0.0,
+            help="Seconds to wait before returning the replayed data",
+        ),
+    ]
+    for option in reversed(options):
+        command = option(command)
+
+    return command
+
+
+def use_recorder(record_http, replay_http, http_latency):
+    if record_http is not None and replay_http is not None:
+        raise click.UsageError("--record-http and --replay-http are exclusive")
+
+    if record_http is not None:
+        sources.recorder = Recorder(record_http, RECORD)
+    elif replay_http is not None:
+        sources.recorder = Recorder(replay_http, REPLAY, http_latency)
 
 
 @click.group(chain=True)
@@ -100,15 +289,48 @@ def cli():
 @click.option("--config", default="config.json", help="The path to the config")
 @click.option("--bind", default="127.0.0.1", help="The port to bind to")
 @click.option("--port", default=8080, help="The port to listen to")
-def run(config, bind, port):
+@click.option("--cache-dir", default=None, help="Where to save the state to restart")
+@click.option(
+    "--render-workers", default=0, help="The number of rendering processes (0: threads)"
+)
+@click.option(
+    "--max-updates",
+    default=MAX_CONCURRENT_UPDATES,
+    help="The maximum number of displays updated at once",
+)
+@click.option("--watch", is_flag=True, help="Reload the config when it changes")
+@recorder_options
+def run(
+    config,
+    bind,
+    port,
+    cache_dir,
+    render_workers,
+    max_updates,
+    watch,
+    record_http,
+    replay_http,
+    http_latency,
+):
+    use_recorder(record_http, replay_http, http_latency)
     formatter = "[%(asctime)s] :: %(levelname)s :: %(name)s :: %(message)s"
     logging.basicConfig(level=logging.INFO, format=formatter)
     loop = asyncio.get_event_loop()
 
     # Initialize
     context = Context()
+    http = HttpClient()
     web_server = loop.run_until_complete(launch_web_server(context, bind, port))
-    loop.run_until_complete(initialize_displays(context, config))
+    fleet = Fleet(context, http, cache_dir, render_workers, max_updates)
+    loop.run_until_complete(initialize_displays(context, config, fleet))
+    loop.create_task(monitor_event_loop())
+
+    # Reload the configuration on SIGHUP, or when it changes if requested
+    loop.add_signal_handler(
+        signal.SIGHUP, lambda: loop.create_task(reload_config(config, fleet))
+    )
+    if watch:
+        loop.create_task(watch_config(config, fleet))
 
     # Run until stopped
     try:
@@ -119,22 +341,115 @@ def run(config, bind, port):
     # Cleanup servers
     # loop.run_until_complete(image_generator.stop())
     loop.run_until_complete(web_server.cleanup())
+    loop.run_until_complete(http.close())
+    fleet.shutdown()
     logging.info("Bye bye !")
 
 
 @cli.command()
 @click.option("--config", default="config.json", help="The path to the config")
+@click.option("--at", help="Render at this ISO 8601 time instead of now")
+@recorder_options
 @click.argument("display")
 @click.argument("output")
-def gen(config, display, output):
+def gen(config, at, record_http, replay_http, http_latency, display, output):
+    use_recorder(record_http, replay_http, http_latency)
     with open(config) as config_file:
         config = json.load(config_file)
 
+    if at is not None:
+        utils.simulated_now = utils.parse_time(at)
     display = Display(config["displays"][display])
     image = display.update_image()
 
     image.save(output, format="PNG", compress_level=9)
 
 
+@cli.command()
+@click.option("--config", default="config.json", help="The path to the config")
+@click.option(
+    "--display",
+    "-d",
+    "display_ids",
+    multiple=True,
+    help="A display to render, all the displays by default",
+)
+@click.option(
+    "--at",
+    "times",
+    multiple=True,
+    help="An ISO 8601 time to render the displays at, now by default",
+)
+@click.option(
+    "--workers", default=os.cpu_count(), help="The number of render processes"
+)
+@click.option("--sheet", help="Also save a contact sheet of all the frames")
+@recorder_options
+@click.argument("output")
+def batch(
+    config,
+    display_ids,
+    times,
+    workers,
+    sheet,
+    record_http,
+    replay_http,
+    http_latency,
+    output,
+):
+    """ Renders several displays at several times into the output directory
+    """
+    use_recorder(record_http, replay_http, http_latency)
+    with open(config) as config_file:
+        config = json.load(config_file)
+
+    ids = list(display_ids or config["displays"])
+    times = [utils.parse_time(at) for at in times] or [utils.now(None).astimezone()]
+    configs = {id: config["displays"][id] for id in ids}
+
+    paths = batch_render.render_batch(configs, times, output, workers)
+    click.echo(f"Rendered {len(paths)} of {len(ids) * len(times)} frames to {output}")
+
+    if sheet is not None:
+        batch_render.contact_sheet(paths, ids, times).save(sheet, format="PNG")
+
+
+@cli.command()
+@click.option("--config", default="config.json", help="The path to the config")
+@click.option("--fixtures", required=True, help="The path to the widget fixtures")
+@click.option("--record", is_flag=True, help="Fetch the data and save the fixtures")
+@click.option("--iterations", "-n", default=20, help="The number of renders")
+@click.option("--json", "as_json", is_flag=True, help="Output the results as JSON")
+@recorder_options
+@click.argument("display")
+def bench(
+    config,
+    fixtures,
+    record,
+    iterations,
+    as_json,
+    record_http,
+    replay_http,
+    http_latency,
+    display,
+):
+    use_recorder(record_http, replay_http, http_latency)
+    with open(config) as config_file:
+        config = json.load(config_file)
+
+    display = Display(config["displays"][display])
+    if record:
+        benchmark.record_fixtures(display, fixtures)
+
+    results = benchmark.run_benchmark(
+        display, benchmark.load_fixtures(fixtures), iterations
+    )
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+    else:
+        click.echo(benchmark.format_results(results))
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,44 @@
+import pytz
+import pytest
+from datetime import datetime
+from epaperengine import utils
+from epaperengine.display import Display
+
+TIMEZONE = "America/New_York"
+
+
+def date_widget(position="0, 0", **options):
+    return {"widget": "date", "position": position, "size": "640x68", **options}
+
+
+def display_config(*widgets, **options):
+    return {
+        "size": "640x384",
+        "updateEvery": 600,
+        "settings": {"locale": "en_US", "timezone": TIMEZONE, "units": "metric"},
+        "widgets": list(widgets) or [date_widget()],
+        **options,
+    }
+
+
+def display_with(widget, **options):
+    """ Returns a display showing the given widget in place of the date
+    """
+    display = Display(display_config(**options))
+    _, position, size = display.widgets[0]
+    display.widgets[0] = (widget, position, size)
+    return display
+
+
+@pytest.fixture
+def set_now(monkeypatch):
+    """ Returns a function simulating the current time, in the timezone of
+    the displays
+    """
+
+    def set_now(*args):
+        at = pytz.timezone(TIMEZONE).localize(datetime(*args))
+        monkeypatch.setattr(utils, "simulated_now", at)
+        return at
+
+    return set_now
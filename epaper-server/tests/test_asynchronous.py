@@ -0,0 +1,115 @@
+import time
+import asyncio
+import pytest
+from PIL import Image
+from conftest import date_widget, display_config, display_with
+from epaperengine import utils
+from epaperengine.asynchronous import (
+    DisplayUpdater,
+    Frames,
+    image_version,
+    record_timings,
+)
+from epaperengine.display import Display
+from epaperengine.widgets.base import BaseWidget
+
+
+class FreshWidget(BaseWidget):
+    """ Updated often, of which the data stays fresh for an hour
+    """
+
+    def __init__(self):
+        pass
+
+    def data_expires_at(self):
+        return utils.expires_in(3600)
+
+
+@pytest.mark.parametrize("update_every", [600, "1 day"])
+def test_render_at_midnight(set_now, update_every):
+    set_now(2026, 10, 17, 23, 58)
+    display = Display(display_config(date_widget(updateEvery=update_every)))
+    updater = DisplayUpdater("home", display, None)
+
+    next_update = asyncio.run(updater.update()) - time.monotonic()
+    assert 118 < next_update <= 120
+    assert display.status["next_update"] - time.monotonic() <= 140
+
+
+def test_wait_for_fresh_data(set_now):
+    set_now(2026, 10, 17, 12, 0)
+    display = display_with(FreshWidget(), updateEvery=60)
+
+    next_updates = [time.monotonic() + 60]
+    next_change = display.next_change(next_updates, None) - time.monotonic()
+    assert 3598 < next_change <= 3600
+
+
+def frame(*pixels):
+    # Black and white, as the frames of the displays
+    image = Image.new("P", (4, 1), color=1)
+    image.putpalette([0, 0, 0, 255, 255, 255])
+    for x in pixels:
+        image.putpixel((x, 0), 0)
+    return image
+
+
+def test_same_content_same_version():
+    frames = Frames()
+    assert frames.publish(frame(0))
+    version = frames.version
+
+    assert not frames.publish(frame(0))
+    assert frames.version == version == image_version(frame(0))
+
+
+def test_delta_from_each_previous_version():
+    frames = Frames()
+    frames.publish(frame())
+    first = frames.version
+    frames.publish(frame(1))
+    second = frames.version
+    frames.publish(frame(1, 3))
+
+    assert frames.deltas[first][0] == (1, 0, 4, 1)
+    assert frames.deltas[second][0] == (3, 0, 4, 1)
+
+
+class FailingWidget(BaseWidget):
+    """ Fails to update after the first time
+    """
+
+    def __init__(self):
+        self.updates = 0
+
+    def update(self):
+        self.updates += 1
+        if self.updates > 1:
+            raise ValueError("Upstream unavailable")
+
+
+def test_stale_after_a_failed_update(set_now):
+    set_now(2026, 10, 17, 12, 0)
+    display = display_with(FailingWidget())
+    updater = DisplayUpdater("home", display, None)
+    asyncio.run(updater.update())
+    updated_at = display.updated_at
+
+    updater.expire()
+    asyncio.run(updater.update())
+    assert display.updated_at == updated_at
+
+
+def test_timing_written_while_recorded():
+    display = Display(display_config())
+
+    class Timings(dict):
+        def items(self):
+            # Such as an update which timed out, from its thread
+            for item in super().items():
+                display.timings["update.date#0"] = 0.5
+                yield item
+
+    display.timings = Timings(composite=0.01)
+    record_timings("home", display)
+    assert display.timings == {"update.date#0": 0.5}
@@ -0,0 +1,45 @@
+import time
+import asyncio
+from datetime import timezone
+from conftest import display_with
+from epaperengine import utils
+from epaperengine.batch import fetch_data
+from epaperengine.widgets.base import BaseWidget
+
+
+class ClockWidget(BaseWidget):
+    """ Saves the simulated time at the end of a slow update, fails at the
+    times given
+    """
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.time = None
+
+    def update(self):
+        time.sleep(0.2)
+        if utils.now(timezone.utc) in self.failing:
+            raise ValueError("Upstream unavailable")
+        self.time = utils.now(timezone.utc)
+
+    def dump_data(self):
+        return self.time.timestamp()
+
+
+def test_wait_for_the_updates_at_each_time(set_now):
+    times = [set_now(2026, 10, 17, 12, 0), set_now(2026, 10, 18, 12, 0)]
+    display = display_with(ClockWidget(), widgetTimeout=0.05)
+
+    data = asyncio.run(fetch_data({"home": display}, times))
+    assert [data["home", at]["date#0"] for at in times] == [
+        at.timestamp() for at in times
+    ]
+
+
+def test_skip_the_time_of_a_failed_update(set_now, caplog):
+    times = [set_now(2026, 10, 17, 12, 0), set_now(2026, 10, 18, 12, 0)]
+    display = display_with(ClockWidget(failing=[times[1]]))
+
+    data = asyncio.run(fetch_data({"home": display}, times))
+    assert list(data) == [("home", times[0])]
+    assert "Could not update display home at" in caplog.text
@@ -0,0 +1,71 @@
+import time
+import asyncio
+import pytest
+from conftest import date_widget, display_config, display_with
+from epaperengine.display import Display
+from epaperengine.widgets.base import BaseWidget
+
+
+def test_render_again_after_a_change(set_now):
+    display = Display(display_config(date_widget(), date_widget("0, 100")))
+    set_now(2026, 10, 17, 12, 0)
+    first = display.render_image()
+
+    # The changed widgets are pasted again at their position
+    set_now(2026, 10, 18, 12, 0)
+    second = display.render_image()
+    assert second.tobytes() != first.tobytes()
+    assert display.widgets[1][1] == (0, 100)
+
+
+def test_reuse_the_frame_when_nothing_changed(set_now):
+    display = Display(display_config())
+    set_now(2026, 10, 17, 12, 0)
+    frame = display.render_image()
+
+    display.timings.clear()
+    assert display.render_image() is frame
+    assert not any(stage.startswith("draw.") for stage in display.timings)
+
+
+class FakeWidget(BaseWidget):
+    """ Updates with the given function, which raises to fail
+    """
+
+    def __init__(self, update):
+        self.update = update
+
+
+def fake_display(update, timeout=30):
+    display = display_with(FakeWidget(update))
+    display.timeouts[0] = timeout
+    return display
+
+
+def test_previous_data_after_a_timeout(caplog):
+    display = fake_display(lambda: None, timeout=0.1)
+    display.update_widgets()
+
+    display.widgets[0][0].update = lambda: time.sleep(0.5)
+    assert asyncio.run(display.update_widgets_async(None)) == [0]
+    assert "did not update within 0.1 seconds" in caplog.text
+
+
+def test_timeout_raised_by_the_widget_is_an_error(caplog):
+    display = fake_display(lambda: None)
+    display.update_widgets()
+
+    def update():
+        raise TimeoutError("timed out")
+
+    # Such as the timeout of a socket
+    display.widgets[0][0].update = update
+    assert asyncio.run(display.update_widgets_async(None)) == [0]
+    assert "Error while updating FakeWidget" in caplog.text
+    assert "did not update within" not in caplog.text
+
+
+def test_first_update_fails_without_previous_data():
+    display = fake_display(lambda: time.sleep(0.5), timeout=0.1)
+    with pytest.raises(TimeoutError):
+        display.update_widgets()
@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from conftest import date_widget, display_config
+from epaperengine.fleet import Fleet
+from run import Context
+
+
+def fleet_config(**displays):
+    return {
+        "displays": displays,
+        "tokens": {f"token-{id}": id for id in displays},
+    }
+
+
+def test_only_restart_the_changed_displays():
+    async def main():
+        context = Context()
+        fleet = Fleet(context, None)
+        await fleet.load(fleet_config(home=display_config(), office=display_config()))
+        home = context.displays["home"]
+
+        moved = display_config(date_widget("0, 100"))
+        started, removed = await fleet.load(
+            fleet_config(home=display_config(), office=moved, kitchen=display_config())
+        )
+        assert sorted(started) == ["kitchen", "office"]
+        assert removed == []
+        assert context.displays["home"] is home
+        assert context.get_display_id("token-kitchen") == "kitchen"
+
+        started, removed = await fleet.load(fleet_config(home=display_config()))
+        assert (started, removed) == ([], ["office", "kitchen"])
+        assert list(context.displays) == ["home"]
+        assert context.get_display_id("token-office") is None
+
+    asyncio.run(main())
+
+
+def test_invalid_configuration_changes_nothing():
+    async def main():
+        context = Context()
+        fleet = Fleet(context, None)
+        await fleet.load(fleet_config(home=display_config()))
+
+        invalid = display_config(size="big")
+        with pytest.raises(ValueError):
+            await fleet.load(fleet_config(home=invalid, office=display_config()))
+        assert list(context.displays) == ["home"]
+        assert list(context.tokens) == ["token-home"]
+
+    asyncio.run(main())
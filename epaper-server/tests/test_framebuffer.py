@@ -0,0 +1,13 @@
+from PIL import Image
+from epaperengine import framebuffer, helper
+
+
+def test_pack_two_pixels_per_byte():
+    image = Image.new("P", (4, 1))
+    image.putdata([helper.BLACK, helper.WHITE, helper.COLOR, helper.WHITE])
+    assert framebuffer.pack(image) == bytes([0x03, 0x43])
+
+
+def test_compress_long_runs():
+    data = b"\x33" * 300 + b"\x00"
+    assert framebuffer.compress(data) == bytes([255, 0x33, 45, 0x33, 1, 0x00])
@@ -0,0 +1,37 @@
+import os
+from PIL import Image
+from epaperengine import helper, metrics
+
+
+def test_fonts_counted_once_per_file():
+    fonts = helper.FontProvider()
+    fonts.get("OpenSans-Bold-webfont.woff", 20)
+    fonts.get("OpenSans-Bold-webfont.woff", 28)
+
+    path = os.path.join(helper.FONTS_DIRECTORY, "OpenSans-Bold-webfont.woff")
+    assert fonts.memory_usage() == os.path.getsize(path)
+
+
+def test_paste_transparent_image():
+    images = helper.ImageProvider()
+    icon = Image.new("P", (2, 1), color=helper.BLACK)
+    mask = Image.new("1", (2, 1))
+    mask.putpixel((0, 0), 255)
+    images.cache["icon.png"] = (icon, mask)
+
+    image = Image.new("P", (2, 1), color=helper.WHITE)
+    draw_helper = helper.DrawHelper(helper.fonts, images, None, image)
+    draw_helper.paste_image("icon.png", (0, 0))
+    assert list(image.getdata()) == [helper.BLACK, helper.WHITE]
+
+
+def test_text_metrics_lookups_counted():
+    lookups = metrics.text_metrics_lookups_total
+    before = dict(lookups.values)
+    text_metrics = helper.TextMetrics(helper.fonts)
+    for _ in range(3):
+        text_metrics.get("Saturday", ("OpenSans-Bold-webfont.woff", 20))
+
+    assert lookups.values[("hit",)] - before.get(("hit",), 0) == 2
+    assert lookups.values[("miss",)] - before.get(("miss",), 0) == 1
+    assert "# TYPE epaper_text_metrics_lookups_total counter" in lookups.render()
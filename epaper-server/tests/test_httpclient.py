@@ -0,0 +1,55 @@
+import asyncio
+import aiohttp
+import pytest
+from aiohttp import web
+from epaperengine import metrics
+from epaperengine.httpclient import HttpClient
+
+
+def get_with_failures(failures, retries):
+    """ Requests a server which answers 503 to the first requests, returns
+    the response and the number of requests received
+    """
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        if len(requests) <= failures:
+            return web.Response(status=503)
+        return web.json_response({"temp": 12})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/weather", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+
+        http = HttpClient(retries=retries, backoff=0)
+        try:
+            return await http.get(f"http://127.0.0.1:{port}/weather")
+        finally:
+            await http.close()
+            await runner.cleanup()
+
+    return asyncio.run(main()), len(requests)
+
+
+def retries():
+    return metrics.http_retries_total.values.get(("127.0.0.1",), 0)
+
+
+def test_retry_then_succeed():
+    before = retries()
+    (status, _, body), requests = get_with_failures(2, retries=3)
+    assert (status, body) == (200, b'{"temp": 12}')
+    assert requests == 3
+    assert retries() - before == 2
+
+
+def test_retries_exhausted():
+    with pytest.raises(aiohttp.ClientResponseError) as error:
+        get_with_failures(5, retries=2)
+    assert error.value.status == 503
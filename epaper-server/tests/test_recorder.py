@@ -0,0 +1,38 @@
+import asyncio
+import pytest
+from epaperengine import sources
+from epaperengine.recorder import RECORD, REPLAY, MissingFixture, Recorder
+
+WEATHER_KEY = ("json", "https://weather", (("id", "1"),))
+MAP_KEY = ("staticmap", "key", (("size", "640x316"),))
+
+
+def unreachable(previous):
+    raise AssertionError("Fetched while replaying")
+
+
+async def unreachable_async(previous):
+    unreachable(previous)
+
+
+def test_record_then_replay(tmp_path, monkeypatch):
+    async def fetch_weather(previous):
+        return {"temp": 12}, None
+
+    monkeypatch.setattr(sources, "recorder", Recorder(str(tmp_path), RECORD))
+    cache = sources.DataCache()
+    asyncio.run(cache.get_async(WEATHER_KEY, fetch_weather, 300))
+    cache.get(MAP_KEY, lambda previous: (b"\x89PNG", None), 0)
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == [".bin", ".json"]
+
+    monkeypatch.setattr(sources, "recorder", Recorder(str(tmp_path), REPLAY))
+    cache = sources.DataCache()
+    weather = asyncio.run(cache.get_async(WEATHER_KEY, unreachable_async, 300))
+    assert weather == {"temp": 12}
+    assert cache.get(MAP_KEY, unreachable, 0) == b"\x89PNG"
+
+
+def test_replay_an_unknown_request(tmp_path, monkeypatch):
+    monkeypatch.setattr(sources, "recorder", Recorder(str(tmp_path), REPLAY))
+    with pytest.raises(MissingFixture):
+        sources.DataCache().get(WEATHER_KEY, unreachable, 300)
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from conftest import display_config
+from epaperengine import renderpool
+from epaperengine.asynchronous import Frames
+from epaperengine.display import Display
+
+
+def test_worker_returns_the_text_metrics_lookups(set_now):
+    set_now(2026, 10, 17, 12, 0)
+    renderpool.configure_worker("home", display_config())
+    try:
+        frame, timings, lookups = renderpool.render_in_worker("home", {})
+        assert frame is not None
+        assert lookups["hit"] + lookups["miss"] > 0
+
+        # Nothing changed, the tile is reused
+        _, _, lookups = renderpool.render_in_worker("home", {})
+        assert lookups == {"hit": 0, "miss": 0}
+    finally:
+        renderpool.configure_worker("home", None)
+
+
+def thread_pool(workers):
+    """ Returns a pool of which the workers are threads of this process
+    """
+    pool = renderpool.RenderPool(workers)
+    pool.executors = [ThreadPoolExecutor(1) for _ in range(workers)]
+    return pool
+
+
+def test_new_display_on_the_least_loaded_worker():
+    pool = thread_pool(2)
+    try:
+        for id in ["home", "office", "kitchen"]:
+            pool.set_display(id, display_config())
+        assert pool.shards == {"home": 0, "office": 1, "kitchen": 0}
+
+        pool.remove_display("office")
+        pool.set_display("garage", display_config())
+        assert pool.shards["garage"] == 1
+    finally:
+        for id in list(pool.shards):
+            pool.remove_display(id)
+        pool.shutdown()
+
+
+def test_send_the_changed_data_once_loaded(set_now, monkeypatch):
+    set_now(2026, 10, 17, 12, 0)
+    pool = thread_pool(1)
+    pool.set_display("home", display_config())
+    display = Display(display_config())
+    display.updated.add(0)
+
+    sent = []
+    render_in_worker = renderpool.render_in_worker
+
+    def failing_render(id, data):
+        sent.append(data)
+        raise ValueError("Could not draw")
+
+    def spy_render(id, data):
+        sent.append(data)
+        return render_in_worker(id, data)
+
+    async def render():
+        return await pool.render("home", display, Frames())
+
+    try:
+        monkeypatch.setattr(renderpool, "render_in_worker", failing_render)
+        with pytest.raises(ValueError):
+            asyncio.run(render())
+
+        # The data is sent again after the failure, then only when it changes
+        monkeypatch.setattr(renderpool, "render_in_worker", spy_render)
+        asyncio.run(render())
+        asyncio.run(render())
+        set_now(2026, 10, 18, 12, 0)
+        asyncio.run(render())
+        assert [list(data) for data in sent] == [["date#0"], ["date#0"], [], ["date#0"]]
+    finally:
+        pool.remove_display("home")
+        pool.shutdown()
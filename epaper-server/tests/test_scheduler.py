@@ -0,0 +1,95 @@
+import time
+import asyncio
+from epaperengine import scheduler
+from epaperengine.scheduler import Scheduler
+
+
+class FakeUpdater:
+    """ Counts its updates and the concurrent ones, fails while failures
+    remain
+    """
+
+    def __init__(self, running, failures=0, duration=0.05):
+        self.running = running
+        self.failures = failures
+        self.duration = duration
+        self.updates = 0
+        self.expired = False
+
+    def expire(self):
+        self.expired = True
+
+    async def update(self):
+        self.running.append(self)
+        self.running.max = max(self.running.max, len(self.running))
+        try:
+            await asyncio.sleep(self.duration)
+        finally:
+            self.running.remove(self)
+
+        self.updates += 1
+        if self.failures:
+            self.failures -= 1
+            raise ValueError("Upstream unavailable")
+        return time.monotonic() + 3600
+
+
+class Running(list):
+    max = 0
+
+
+def test_limit_the_concurrent_updates():
+    running = Running()
+    updaters = [FakeUpdater(running) for _ in range(6)]
+
+    async def main():
+        queue = Scheduler(max_concurrent=2)
+        for index, updater in enumerate(updaters):
+            queue.add(f"display-{index}", updater, delay=0)
+        queue.start()
+        await asyncio.sleep(0.3)
+        queue.task.cancel()
+
+    asyncio.run(main())
+    assert running.max == 2
+    assert all(updater.updates == 1 for updater in updaters)
+
+
+def test_retry_with_backoff(monkeypatch, caplog):
+    monkeypatch.setattr(scheduler, "RETRY_DELAY", 0.05)
+    updater = FakeUpdater(Running(), failures=2, duration=0)
+
+    async def main():
+        queue = Scheduler()
+        queue.add("home", updater, delay=0)
+        queue.start()
+
+        # Retried after 0.05 then 0.1 seconds
+        await asyncio.sleep(0.1)
+        assert updater.updates == 2
+        await asyncio.sleep(0.15)
+        assert updater.updates == 3
+        assert "home" not in queue.failures
+        queue.task.cancel()
+
+    asyncio.run(main())
+    assert "retrying in 0.1 seconds" in caplog.text
+
+
+def test_refresh_during_an_update():
+    updater = FakeUpdater(Running(), duration=0.1)
+
+    async def main():
+        queue = Scheduler()
+        queue.add("home", updater, delay=0)
+        queue.start()
+        await asyncio.sleep(0.05)
+
+        # Runs again once the current update ends
+        queue.refresh("home")
+        await asyncio.sleep(0.3)
+        queue.task.cancel()
+
+    asyncio.run(main())
+    assert updater.expired
+    assert updater.updates == 2
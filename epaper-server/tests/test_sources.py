@@ -0,0 +1,177 @@
+import time
+import asyncio
+import threading
+import pytz
+import pytest
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from epaperengine import sources
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ Replaces the monotonic clock of the cache, returns a list of which the
+    first item is the current time
+    """
+    now = [1000.0]
+    monkeypatch.setattr(sources.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_expired_entries_are_evicted(clock):
+    cache = sources.DataCache()
+    cache.get("old", lambda previous: ("old", None), 300)
+
+    clock[0] += 300 + sources.STALE_TTL
+    cache.get("new", lambda previous: ("new", None), 300)
+    assert list(cache.entries) == ["new"]
+
+
+def test_expired_entries_are_kept_to_be_revalidated(clock):
+    cache = sources.DataCache()
+    cache.get("key", lambda previous: ("value", {"ETag": '"1"'}), 300)
+
+    clock[0] += 600
+    cache.get("other", lambda previous: ("other", None), 300)
+
+    def revalidate(previous):
+        assert previous.validators == {"ETag": '"1"'}
+        return previous.value, previous.validators
+
+    assert cache.get("key", revalidate, 300) == "value"
+
+
+class Interrupted(BaseException):
+    pass
+
+
+def test_waiting_threads_get_the_interruption():
+    cache = sources.DataCache()
+    release = threading.Event()
+
+    def fetch(previous):
+        release.wait()
+        raise Interrupted()
+
+    with ThreadPoolExecutor(2) as executor:
+        owner = executor.submit(cache.get, "key", fetch, 300)
+        time.sleep(0.05)
+        waiter = executor.submit(cache.get, "key", fetch, 300)
+        time.sleep(0.05)
+        release.set()
+
+        with pytest.raises(Interrupted):
+            owner.result(timeout=5)
+        with pytest.raises(Interrupted):
+            waiter.result(timeout=5)
+
+
+def test_no_entry_without_ttl():
+    cache = sources.DataCache()
+    fetches = []
+
+    def fetch(previous):
+        fetches.append(previous)
+        return b"png", None
+
+    cache.get("map", fetch, 0)
+    cache.get("map", fetch, 0)
+    assert fetches == [None, None]
+    assert cache.entries == {}
+
+
+class FakeHttp:
+    """ Returns the given responses in order, records the headers sent
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.headers = []
+
+    async def get(self, url, params=None, headers=None):
+        self.headers.append(headers)
+        return self.responses.pop(0)
+
+
+def test_not_modified_without_a_cached_body(monkeypatch):
+    monkeypatch.setattr(sources, "cache", sources.DataCache())
+    http = FakeHttp((304, {}, b""), (200, {"ETag": '"1"'}, b'{"temp": 12}'))
+
+    value = asyncio.run(sources.get_json_async(http, "https://weather", {}, 300))
+    assert value == {"temp": 12}
+    assert http.headers == [{}, sources.NO_CACHE_HEADERS]
+
+
+def test_not_modified_twice_without_a_cached_body(monkeypatch):
+    monkeypatch.setattr(sources, "cache", sources.DataCache())
+    http = FakeHttp((304, {}, b""), (304, {}, b""))
+
+    with pytest.raises(ValueError):
+        asyncio.run(sources.get_json_async(http, "https://weather", {}, 300))
+
+
+def test_all_day_event_in_local_time():
+    timezone = pytz.timezone("America/New_York")
+    assert sources._event_time({"date": "2026-11-02"}, timezone) == (
+        timezone.localize(datetime(2026, 11, 2))
+    )
+
+    # The window starts before the end of the daylight saving time
+    time_min = timezone.localize(datetime(2026, 10, 31))
+    start = sources._event_time({"date": "2026-11-02"}, time_min.tzinfo)
+    assert start.utcoffset() == timedelta(hours=-5)
+
+
+class FakeCalendarService:
+    """ Returns an event per calendar, records the size of the batches
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def events(self):
+        return self
+
+    def list(self, calendarId, **params):
+        return calendarId
+
+    def list_next(self, request, response):
+        return None
+
+    def new_batch_http_request(self, callback):
+        service = self
+
+        class Batch:
+            def __init__(self):
+                self.requests = []
+
+            def add(self, request, request_id):
+                self.requests.append((request, request_id))
+
+            def execute(self):
+                service.batches.append(len(self.requests))
+                for calendar_id, request_id in self.requests:
+                    event = {
+                        "id": calendar_id,
+                        "start": {"date": "2026-10-17"},
+                        "end": {"date": "2026-10-18"},
+                    }
+                    callback(request_id, {"items": [event]}, None)
+
+        return Batch()
+
+
+def test_calendars_fetched_in_batches_of_50():
+    sync = sources.CalendarSync.__new__(sources.CalendarSync)
+    sync.lock = threading.Lock()
+    sync.service = FakeCalendarService()
+    sync.window = None
+
+    timezone = pytz.timezone("America/New_York")
+    time_min = timezone.localize(datetime(2026, 10, 17))
+    time_max = timezone.localize(datetime(2026, 10, 17, 23, 59, 59))
+    calendar_ids = [f"calendar-{index}" for index in range(120)]
+
+    events = sync.fetch(calendar_ids, time_min, time_max)
+    assert sync.service.batches == [50, 50, 20]
+    assert sorted(event["id"] for event in events) == sorted(calendar_ids)
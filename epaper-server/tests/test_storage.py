@@ -0,0 +1,63 @@
+import os
+from conftest import display_config, display_with
+from epaperengine.display import Display
+from epaperengine.storage import DisplayStorage
+from epaperengine.widgets.base import BaseWidget
+
+
+def modified(storage):
+    return os.stat(os.path.join(storage.path, "widgets.json")).st_mtime_ns
+
+
+def test_save_the_widgets_when_they_change(tmp_path, set_now):
+    display = Display(display_config())
+    display.updated.add(0)
+    storage = DisplayStorage(str(tmp_path), "home")
+
+    set_now(2026, 10, 17, 12, 0)
+    storage.save_widgets(display)
+    os.utime(os.path.join(storage.path, "widgets.json"), ns=(0, 0))
+    storage.save_widgets(display)
+    assert modified(storage) == 0
+
+    # The date widget changes with the day
+    set_now(2026, 10, 18, 12, 0)
+    storage.save_widgets(display)
+    assert modified(storage) != 0
+
+
+class DataWidget(BaseWidget):
+    def __init__(self):
+        self.data = None
+
+    def dump_data(self):
+        return self.data
+
+    def load_data(self, data):
+        self.data = data
+
+    def fingerprint(self):
+        return self.data
+
+
+def data_display(data=None):
+    display = display_with(DataWidget())
+    if data is not None:
+        display.widgets[0][0].load_data(data)
+        display.updated.add(0)
+    return display
+
+
+def test_restored_widgets_are_not_saved_again(tmp_path):
+    DisplayStorage(str(tmp_path), "home").save_widgets(data_display("data"))
+    os.utime(os.path.join(tmp_path, "home", "widgets.json"), ns=(0, 0))
+
+    storage = DisplayStorage(str(tmp_path), "home")
+    display = data_display()
+    storage.restore(display)
+    storage.save_widgets(display)
+    assert modified(storage) == 0
+
+    display.widgets[0][0].load_data("new data")
+    storage.save_widgets(display)
+    assert modified(storage) != 0
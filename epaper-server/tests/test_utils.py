@@ -0,0 +1,15 @@
+import pytest
+from datetime import timedelta
+from epaperengine.utils import parse_duration
+
+
+def test_parse_duration():
+    assert parse_duration(600) == timedelta(minutes=10)
+    assert parse_duration("1 hour") == timedelta(hours=1)
+    assert parse_duration("1.5 days") == timedelta(hours=36)
+
+
+@pytest.mark.parametrize("duration", ["1 fortnight", "10min", "", 0, -60, "0 seconds"])
+def test_invalid_duration(duration):
+    with pytest.raises(ValueError, match="Invalid duration"):
+        parse_duration(duration)
@@ -0,0 +1,84 @@
+import os
+import asyncio
+from PIL import Image
+from epaperengine import sources
+from epaperengine.widgets import GooglecalendarWidget, GooglemapsWidget, WeatherWidget
+from epaperengine.widgets.googlemaps import MapCache
+
+SETTINGS = {"locale": "en_US", "timezone": "America/New_York", "units": "metric"}
+
+
+def weather_widget():
+    settings = {**SETTINGS, "api_key": "key", "city_id": "1"}
+    return WeatherWidget(settings, (340, 200))
+
+
+def calendar_widget(tmp_path):
+    settings = {
+        **SETTINGS,
+        "credentials": str(tmp_path / "credentials.json"),
+        "token_store": str(tmp_path / "token.pickle"),
+    }
+    return GooglecalendarWidget(settings, (300, 384))
+
+
+def maps_widget():
+    settings = {
+        **SETTINGS,
+        "client_key": "key",
+        "home_address": "Home",
+        "work_address": "Work",
+    }
+    return GooglemapsWidget(settings, (340, 384))
+
+
+def test_no_data_before_the_first_update(tmp_path):
+    assert weather_widget().dump_data() is None
+    assert maps_widget().dump_data() is None
+    assert calendar_widget(tmp_path).dump_data() is None
+
+
+def test_fingerprint_before_the_first_update(tmp_path):
+    # The date is part of the fingerprint of the calendar
+    assert weather_widget().fingerprint() is None
+    assert calendar_widget(tmp_path).fingerprint()[1] is None
+
+
+def test_weather_data_replaced_at_once(monkeypatch):
+    widget = weather_widget()
+    widget.load_data({"now": "old now", "forecast": "old forecast"})
+    forecast_sent = asyncio.Event()
+
+    async def get_json_async(http, url, params, ttl):
+        if url.endswith("forecast"):
+            await forecast_sent.wait()
+        return f"new {url.rsplit('/', 1)[1]}"
+
+    monkeypatch.setattr(sources, "get_json_async", get_json_async)
+
+    async def update():
+        task = asyncio.create_task(widget.update_async(None))
+        await asyncio.sleep(0.01)
+
+        # The current weather was received, the widget is drawn meanwhile
+        assert widget.dump_data() == {"now": "old now", "forecast": "old forecast"}
+        forecast_sent.set()
+        await task
+
+    asyncio.run(update())
+    assert widget.dump_data() == {"now": "new weather", "forecast": "new forecast"}
+
+
+def test_map_directory_keeps_the_recent_maps(tmp_path):
+    maps = MapCache(2, str(tmp_path))
+    for index, key in enumerate(["a", "b"]):
+        maps.put(key, Image.new("P", (10, 10)))
+        os.utime(maps._path(key), (index, index))
+
+    # The map read from the directory is used again
+    maps.maps.clear()
+    maps.get("a")
+    maps.put("c", Image.new("P", (10, 10)))
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(maps._path(key)) for key in ["a", "c"]
+    )